@@ -0,0 +1,215 @@
+"""Cache of Clash Royale API responses with per-endpoint TTLs and stale-while-revalidate"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from cr_api import normalize_tag
+
+# Seconds a response is served without asking the API again, per endpoint
+CACHE_TTLS = {'player': 60, 'battlelog': 120, 'upcomingchests': 300}
+
+# Past its TTL, a response is still served for this many seconds while a
+# background refresh fetches a new one
+STALE_WHILE_REVALIDATE = 300
+
+# Responses kept before the least recently used are evicted
+CACHE_SIZE = 10000
+
+# ClashRoyaleAPI method behind each cached endpoint
+ENDPOINT_METHODS = {'player': 'get_player', 'battlelog': 'get_battlelog', 'upcomingchests': 'get_upcoming_chests'}
+
+# A cached response: when it was fetched (epoch seconds), its ETag and its JSON data
+CachedResponse = namedtuple('CachedResponse', ['fetched_at', 'etag', 'data'])
+
+
+class MemoryResponseCache:
+    """Responses in an in-process LRU dict, lost on restart"""
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The cached response for an (endpoint, player_tag) key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        """Cache a response, evicting the least recently used past max_entries"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteResponseCache:
+    """Responses in a SQLite database (WAL mode), shared by workers and kept across restarts
+
+    Recency is tracked in a used_at column, bumped at most once a minute per
+    response so hits stay reads; eviction runs every few hundred writes.
+    """
+
+    TOUCH_INTERVAL = 60
+    EVICT_EVERY = 200
+
+    def __init__(self, db_path, max_entries=CACHE_SIZE):
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._puts = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "endpoint TEXT NOT NULL, "
+                "player_tag TEXT NOT NULL, "
+                "fetched_at REAL NOT NULL, "
+                "etag TEXT, "
+                "data TEXT NOT NULL, "
+                "used_at REAL NOT NULL, "
+                "PRIMARY KEY (endpoint, player_tag))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_used_at ON responses (used_at)")
+
+    def _connect(self):
+        """Per-thread connection; sqlite3 connections can't be shared between threads"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """The cached response for an (endpoint, player_tag) key, or None"""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT fetched_at, etag, data, used_at FROM responses WHERE endpoint = ? AND player_tag = ?", key
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[3] > self.TOUCH_INTERVAL:
+            with conn:
+                conn.execute("UPDATE responses SET used_at = ? WHERE endpoint = ? AND player_tag = ?", (now, *key))
+        return CachedResponse(row[0], row[1], json.loads(row[2]))
+
+    def put(self, key, entry):
+        """Cache a response, evicting the least recently used past max_entries"""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (endpoint, player_tag, fetched_at, etag, data, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, entry.fetched_at, entry.etag, json.dumps(entry.data), time.time()),
+            )
+            self._puts += 1
+            if self._puts % self.EVICT_EVERY == 0:
+                conn.execute(
+                    "DELETE FROM responses WHERE rowid IN "
+                    "(SELECT rowid FROM responses ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+
+class CachedClashRoyaleAPI:
+    """ClashRoyaleAPI with its player, battlelog and upcoming chest responses cached
+
+    A response younger than its endpoint's TTL is served from the cache. An
+    older one is still served for up to stale_for seconds while a background
+    thread refreshes it; past that, the call waits for the API. Refreshes are
+    conditional on the cached ETag, and when the API fails the last good
+    response is served instead of the error. Results from the cache carry
+    cached=True and their age in seconds; callers never see the data a
+    background refresh fetches, so it is handed to on_refresh(endpoint,
+    player_tag, data) instead.
+    """
+
+    def __init__(self, api, cache=None, ttls=None, stale_for=STALE_WHILE_REVALIDATE, refresh_workers=4,
+                 on_refresh=None):
+        self.api = api
+        self.cache = cache if cache is not None else MemoryResponseCache()
+        self.ttls = {**CACHE_TTLS, **(ttls or {})}
+        self.stale_for = stale_for
+        self.on_refresh = on_refresh
+        self._refresher = ThreadPoolExecutor(refresh_workers, thread_name_prefix='cr-api-refresh')
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get_player(self, player_tag):
+        """Get player information by tag"""
+        return self._get('player', player_tag)
+
+    def get_battlelog(self, player_tag):
+        """Get player's recent battles"""
+        return self._get('battlelog', player_tag)
+
+    def get_upcoming_chests(self, player_tag):
+        """Get player's upcoming chests"""
+        return self._get('upcomingchests', player_tag)
+
+    def __getattr__(self, name):
+        # Anything not cached, e.g. get_player_snapshot, goes straight to the client
+        return getattr(self.api, name)
+
+    def _get(self, endpoint, player_tag):
+        key = (endpoint, normalize_tag(player_tag))
+        entry = self.cache.get(key)
+        if entry is not None:
+            age = time.time() - entry.fetched_at
+            if age < self.ttls[endpoint]:
+                return self._cached(entry)
+            if age < self.ttls[endpoint] + self.stale_for:
+                self._refresh_later(key, entry)
+                return self._cached(entry)
+        return self._fetch(key, entry)
+
+    @staticmethod
+    def _cached(entry):
+        # Every hit shares the cached data; callers must not modify it
+        return {'success': True, 'data': entry.data, 'cached': True, 'age': time.time() - entry.fetched_at}
+
+    def _fetch(self, key, entry):
+        """Ask the API for a response, caching it; falls back to the cached one on failure"""
+        endpoint, player_tag = key
+        result = getattr(self.api, ENDPOINT_METHODS[endpoint])(player_tag, etag=entry.etag if entry else None)
+        if not result['success']:
+            if entry is not None:
+                print(f"Serving cached {endpoint} for {player_tag}: {result['error']}")
+                return self._cached(entry)
+            return result
+
+        if result.get('not_modified'):
+            data, etag = entry.data, result.get('etag', entry.etag)
+        else:
+            data, etag = result['data'], result.get('etag')
+        self.cache.put(key, CachedResponse(time.time(), etag, data))
+        return {'success': True, 'data': data}
+
+    def _refresh_later(self, key, entry):
+        """Refresh a stale response on a background thread, once per key at a time"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._refresher.submit(self._refresh, key, entry)
+
+    def _refresh(self, key, entry):
+        try:
+            result = self._fetch(key, entry)
+            if self.on_refresh and result['success'] and not result.get('cached'):
+                self.on_refresh(*key, result['data'])
+        except Exception as e:
+            print(f"Error refreshing {key[0]} for {key[1]}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
@@ -1,11 +1,26 @@
 #!/usr/bin/env python3
 """Clash Royale Stats Tracker Web App"""
 
+import json
 import os
-from flask import Flask, render_template, jsonify, request
+from datetime import datetime, timedelta
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from flask import Flask, Response, render_template, jsonify, request
 from dotenv import load_dotenv
-from cr_api import ClashRoyaleAPI
+from api_cache import CachedClashRoyaleAPI, MemoryResponseCache, SQLiteResponseCache, CACHE_SIZE
+from cr_api import ClashRoyaleAPI, normalize_tag
+from battle_store import BattleStore, BattlelogScheduler
+from batch_trends import TREND_RESULT_FIELDS, TREND_WINDOWS, compute_trends, leaderboard
 from data_store import PlayerStatsStore
+from hot_cache import HotCacheScheduler, HOT_CACHE_DAYS
+from player_registry import SORT_COLUMNS
+from stats_compaction import CompactionScheduler
+from stats_backends import STATS_SCHEMA
+from stats_export import EXPORT_FORMATS, stream_export
+from stats_retention import RollupScheduler, RESOLUTIONS, RAW_RETENTION_DAYS, HOURLY_RETENTION_DAYS
+from single_flight import SingleFlight
 from roaster import roast_player, get_performance_emoji, get_skill_rating
 from card_aggregator import get_all_unique_cards
 from kiss_tracker import add_kiss, get_leaderboard, get_card_kisses, remove_kiss
@@ -17,10 +32,62 @@ app = Flask(__name__)
 
 # Initialize services
 cr_api = ClashRoyaleAPI()
-data_store = PlayerStatsStore()
+data_store = PlayerStatsStore(
+    backend=os.getenv('STATS_BACKEND', 'parquet'),
+    buffered=os.getenv('STATS_WRITE_BUFFER', '1') == '1',
+    flush_rows=int(os.getenv('STATS_FLUSH_ROWS', '500')),
+    flush_interval=float(os.getenv('STATS_FLUSH_INTERVAL', '5')),
+    hot_cache_days=int(os.getenv('STATS_HOT_CACHE_DAYS', str(HOT_CACHE_DAYS))),
+)
+
+# Cache API responses in process (memory) or in data/api_cache.sqlite (sqlite), or not at all (off)
+CR_API_CACHE = os.getenv('CR_API_CACHE', 'memory')
+CR_API_CACHE_SIZE = int(os.getenv('CR_API_CACHE_SIZE', str(CACHE_SIZE)))
+
+def _save_refreshed(endpoint, player_tag, data):
+    """Record player data a background cache refresh fetched"""
+    if endpoint == 'player':
+        data_store.save_stats(player_tag, data)
+
+if CR_API_CACHE == 'sqlite':
+    os.makedirs('data', exist_ok=True)
+    response_cache = SQLiteResponseCache('data/api_cache.sqlite', CR_API_CACHE_SIZE)
+    cr_api = CachedClashRoyaleAPI(cr_api, response_cache, on_refresh=_save_refreshed)
+elif CR_API_CACHE == 'memory':
+    cr_api = CachedClashRoyaleAPI(cr_api, MemoryResponseCache(CR_API_CACHE_SIZE), on_refresh=_save_refreshed)
+
+# Keep recent history in a memory-mapped Arrow file shared by all workers
+STATS_HOT_CACHE_INTERVAL = int(os.getenv('STATS_HOT_CACHE_INTERVAL', '60'))
+if data_store.hot_cache and STATS_HOT_CACHE_INTERVAL > 0:
+    HotCacheScheduler(data_store, interval=STATS_HOT_CACHE_INTERVAL).start()
+
+# Optionally compact stats fragments in the background (seconds between runs)
+STATS_COMPACTION_INTERVAL = int(os.getenv('STATS_COMPACTION_INTERVAL', '0'))
+if STATS_COMPACTION_INTERVAL > 0:
+    CompactionScheduler(data_store, interval=STATS_COMPACTION_INTERVAL).start()
+
+# Optionally roll history up into hourly/daily tiers and expire old snapshots
+STATS_ROLLUP_INTERVAL = int(os.getenv('STATS_ROLLUP_INTERVAL', '0'))
+if STATS_ROLLUP_INTERVAL > 0:
+    RollupScheduler(
+        data_store,
+        interval=STATS_ROLLUP_INTERVAL,
+        raw_days=int(os.getenv('STATS_RAW_RETENTION_DAYS', str(RAW_RETENTION_DAYS))),
+        hourly_days=int(os.getenv('STATS_HOURLY_RETENTION_DAYS', str(HOURLY_RETENTION_DAYS))),
+    ).start()
+
+# Optionally ingest every tracked player's battlelog into data/battles (seconds between polls)
+BATTLELOG_POLL_INTERVAL = int(os.getenv('BATTLELOG_POLL_INTERVAL', '0'))
+if BATTLELOG_POLL_INTERVAL > 0:
+    BattlelogScheduler(data_store, BattleStore(), interval=BATTLELOG_POLL_INTERVAL, api=cr_api).start()
 
 DEFAULT_PLAYER_TAG = os.getenv('DEFAULT_PLAYER_TAG', '#2PP')
 
+# Stats columns the history endpoint can return, and how it pages through them
+HISTORY_FIELDS = [name for name in STATS_SCHEMA.names if name != 'unchanged']
+HISTORY_BATCH_ROWS = 1000
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
 @app.route('/')
 def index():
     return render_template('index.html', default_tag=DEFAULT_PLAYER_TAG)
@@ -30,26 +97,35 @@ def cards_page():
     """Cards gallery page with kiss functionality"""
     return render_template('cards.html')
 
+# Concurrent lookups of one player share a single fetch, save and trend calculation
+player_lookups = SingleFlight()
+
+def _lookup_player(player_tag):
+    """Fetch a player's stats, save them to history and calculate their trends"""
+    result = cr_api.get_player(player_tag)
+    if not result['success']:
+        return result, None
+
+    # Save to historical data, cached responses too: every lookup records a
+    # snapshot, and one identical to the last is stored as a marker row
+    try:
+        data_store.save_stats(player_tag, result['data'])
+    except Exception as e:
+        print(f"Error saving stats: {e}")
+
+    return result, data_store.calculate_trends(player_tag, days=7)
+
 @app.route('/api/player/<player_tag>')
 def get_player_stats(player_tag):
     """Get current player stats and update history"""
-    # Fetch from API
-    result = cr_api.get_player(player_tag)
+    # Fetch from API, save and get trends
+    result, trends = player_lookups.do(normalize_tag(player_tag), _lookup_player, player_tag)
 
     if not result['success']:
         return jsonify(result), 400
 
     player_data = result['data']
 
-    # Save to historical data
-    try:
-        data_store.save_stats(player_tag, player_data)
-    except Exception as e:
-        print(f"Error saving stats: {e}")
-
-    # Get trends
-    trends = data_store.calculate_trends(player_tag, days=7)
-
     # Generate roasts
     roasts = roast_player(player_data, trends)
     performance_emoji = get_performance_emoji(player_data, trends)
@@ -66,42 +142,197 @@ def get_player_stats(player_tag):
 
 @app.route('/api/player/<player_tag>/history')
 def get_player_history(player_tag):
-    """Get historical stats for a player"""
-    limit = request.args.get('limit', type=int, default=30)
+    """Get historical stats for a player, newest first, one page at a time
 
-    history_df = data_store.get_player_history(player_tag, limit=limit)
+    before/after are exclusive timestamp cursors: before pages back through
+    older snapshots, after fetches the ones following it. fields= limits the
+    stats columns returned. The JSON is streamed out a batch at a time.
+    """
+    limit = min(max(request.args.get('limit', type=int, default=30), 1), 1000)
+    resolution = request.args.get('resolution', default='raw')
+    fields = request.args.get('fields')
+    columns = [name.strip() for name in fields.split(',') if name.strip()] if fields else None
 
-    if history_df.empty:
+    try:
+        before = _parse_cursor('before')
+        after = _parse_cursor('after')
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'before and after must be ISO 8601 timestamps'
+        }), 400
+    if resolution not in RESOLUTIONS:
+        return jsonify({
+            'success': False,
+            'error': f'resolution must be one of {", ".join(RESOLUTIONS)}'
+        }), 400
+    unknown = [name for name in columns or [] if name not in HISTORY_FIELDS]
+    if unknown:
+        return jsonify({
+            'success': False,
+            'error': f'Unknown fields: {", ".join(unknown)}'
+        }), 400
+
+    # After a cursor the page is the oldest rows, so the limit applies from that end
+    table = data_store.read_history(
+        player_tag,
+        limit=limit,
+        since=after + timedelta(microseconds=1) if after else None,
+        until=before - timedelta(microseconds=1) if before else None,
+        columns=columns,
+        resolution=resolution,
+        oldest=after is not None,
+    )
+    # Oldest first: the page is the oldest rows after a cursor, otherwise the newest ones
+    table = table.slice(0, limit) if after else table.slice(max(table.num_rows - limit, 0))
+
+    if table.num_rows == 0 and before is None and after is None:
         return jsonify({
             'success': False,
             'error': 'No historical data found'
         }), 404
 
-    # Convert to list of dicts for JSON
-    history = history_df.to_dict('records')
+    # Rollup rows also carry their period's first timestamp
+    for name in [field.name for field in table.schema if pa.types.is_timestamp(field.type)]:
+        formatted = pc.strftime(table.column(name), format=TIMESTAMP_FORMAT)
+        table = table.set_column(table.schema.get_field_index(name), name, formatted)
+    timestamps = table.column('timestamp')
+    cursors = {
+        # Older rows may remain while a page comes back full
+        'next_before': timestamps[0].as_py() if table.num_rows == limit else None,
+        'next_after': timestamps[-1].as_py() if table.num_rows else (after.isoformat() if after else None),
+    }
+    return Response(_stream_history(table, cursors), mimetype='application/json')
+
+
+def _parse_cursor(name):
+    """A timestamp query argument, or None"""
+    value = request.args.get(name)
+    return datetime.fromisoformat(value).replace(tzinfo=None) if value else None
+
+
+def _stream_history(table, cursors):
+    """JSON for a history page, newest row first, encoded one batch of rows at a time"""
+    yield '{"success": true, "history": ['
+    for stop in range(table.num_rows, 0, -HISTORY_BATCH_ROWS):
+        batch = table.slice(max(stop - HISTORY_BATCH_ROWS, 0), min(stop, HISTORY_BATCH_ROWS))
+        batch = batch.take(np.arange(batch.num_rows - 1, -1, -1))
+        separator = ',' if stop < table.num_rows else ''
+        yield separator + json.dumps(batch.to_pylist())[1:-1]
+    yield '], ' + json.dumps(cursors)[1:]
+
+@app.route('/api/tracked-players')
+def get_tracked_players():
+    """Get tracked players, paginated, from the player registry"""
+    page = max(request.args.get('page', type=int, default=1), 1)
+    per_page = min(max(request.args.get('per_page', type=int, default=100), 1), 1000)
+    sort = request.args.get('sort', default='last_seen')
+    descending = request.args.get('order', default='desc') != 'asc'
+
+    if sort not in SORT_COLUMNS:
+        return jsonify({
+            'success': False,
+            'error': f'sort must be one of {", ".join(SORT_COLUMNS)}'
+        }), 400
 
-    # Convert timestamps to strings
-    for record in history:
-        record['timestamp'] = record['timestamp'].isoformat()
+    entries = data_store.list_tracked_players(sort=sort, descending=descending,
+                                              offset=(page - 1) * per_page, limit=per_page)
+    for entry in entries:
+        entry['first_seen'] = entry['first_seen'].isoformat()
+        entry['last_seen'] = entry['last_seen'].isoformat()
 
     return jsonify({
         'success': True,
-        'history': history
+        'players': [entry['player_tag'] for entry in entries],
+        'entries': entries,
+        'page': page,
+        'per_page': per_page,
+        'total': data_store.registry.count()
     })
 
-@app.route('/api/tracked-players')
-def get_tracked_players():
-    """Get all tracked player tags"""
-    players = data_store.get_all_tracked_players()
+@app.route('/api/trends')
+def get_all_trends():
+    """Trends for every tracked player over several windows, ranked for leaderboards"""
+    windows = request.args.get('windows', default=','.join(TREND_WINDOWS)).split(',')
+    sort = request.args.get('sort', default='trophy_change')
+    descending = request.args.get('order', default='desc') != 'asc'
+    limit = max(request.args.get('limit', type=int, default=100), 1)
+
+    unknown = [window for window in windows if window not in TREND_WINDOWS]
+    if unknown:
+        return jsonify({
+            'success': False,
+            'error': f'windows must be among {", ".join(TREND_WINDOWS)}'
+        }), 400
+    if sort not in TREND_RESULT_FIELDS:
+        return jsonify({
+            'success': False,
+            'error': f'sort must be one of {", ".join(TREND_RESULT_FIELDS)}'
+        }), 400
+
+    trends = compute_trends(data_store, windows=windows)
     return jsonify({
         'success': True,
-        'players': players
+        'trends': {window: leaderboard(trends[window], sort, descending, limit) for window in windows},
+        'players': {window: trends[window].num_rows for window in windows}
     })
 
+@app.route('/api/export')
+def export_stats():
+    """Stream stats history as Arrow IPC, Parquet or CSV, optionally filtered"""
+    format = request.args.get('format', default='parquet')
+    resolution = request.args.get('resolution', default='raw')
+    players = request.args.get('players')
+    fields = request.args.get('fields')
+    columns = [name.strip() for name in fields.split(',') if name.strip()] if fields else None
+
+    try:
+        since = _parse_cursor('since')
+        until = _parse_cursor('until')
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'since and until must be ISO 8601 timestamps'
+        }), 400
+    if format not in EXPORT_FORMATS:
+        return jsonify({
+            'success': False,
+            'error': f'format must be one of {", ".join(EXPORT_FORMATS)}'
+        }), 400
+    if resolution not in RESOLUTIONS:
+        return jsonify({
+            'success': False,
+            'error': f'resolution must be one of {", ".join(RESOLUTIONS)}'
+        }), 400
+    unknown = [name for name in columns or [] if name not in HISTORY_FIELDS]
+    if unknown:
+        return jsonify({
+            'success': False,
+            'error': f'Unknown fields: {", ".join(unknown)}'
+        }), 400
+
+    extension, content_type = EXPORT_FORMATS[format]
+    chunks = stream_export(
+        data_store,
+        format,
+        player_tags=[tag.strip() for tag in players.split(',')] if players else None,
+        since=since,
+        until=until,
+        columns=columns,
+        resolution=resolution,
+    )
+    return Response(chunks, mimetype=content_type, headers={
+        'Content-Disposition': f'attachment; filename=player_stats.{extension}'
+    })
+
+@app.route('/api/quota')
+def get_api_quota():
+    """Each Clash Royale API key's health, and calls let through and turned away by its rate limit"""
+    return jsonify({'success': True, 'keys': cr_api.keys.stats()})
+
 @app.route('/api/save-sample/<player_tag>')
 def save_sample_response(player_tag):
     """Save a sample API response to file for review"""
-    import json
     result = cr_api.get_player(player_tag)
 
     if result['success']:
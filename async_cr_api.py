@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Asyncio Clash Royale API client for refreshing many players at once"""
+
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cr_api import ClashRoyaleAPI, create_session, normalize_tag
+from single_flight import AsyncSingleFlight
+
+# Requests in flight at once
+CONCURRENCY = int(os.getenv('CR_API_CONCURRENCY', '32'))
+
+
+class AsyncClashRoyaleAPI:
+    """ClashRoyaleAPI with async methods and bulk lookups
+
+    Each call runs the pooled, retrying synchronous client on a worker
+    thread, so responses are handled exactly as ClashRoyaleAPI handles them
+    (including backing off on 429s). At most `concurrency` requests are in
+    flight; the client's connection pool is sized to match so every worker
+    keeps its connection alive. Concurrent calls for the same player and
+    endpoint share one request. Pass api to wrap an existing client, e.g. a
+    CachedClashRoyaleAPI, instead. Use it from one event loop.
+    """
+
+    def __init__(self, api_key=None, concurrency=CONCURRENCY, api=None):
+        self.api = api or ClashRoyaleAPI(api_key, session=create_session(pool_size=concurrency))
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix='cr-api')
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._flights = AsyncSingleFlight()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker threads"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _call(self, method, player_tag):
+        return await self._flights.do((method, normalize_tag(player_tag)), self._run, method, player_tag)
+
+    async def _run(self, method, player_tag):
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, getattr(self.api, method), player_tag)
+
+    async def get_player(self, player_tag):
+        """Get player information by tag"""
+        return await self._call('get_player', player_tag)
+
+    async def get_player_snapshot(self, player_tag):
+        """Get player information by tag as a compact PlayerSnapshot"""
+        return await self._call('get_player_snapshot', player_tag)
+
+    async def get_battlelog(self, player_tag):
+        """Get player's recent battles"""
+        return await self._call('get_battlelog', player_tag)
+
+    async def get_upcoming_chests(self, player_tag):
+        """Get player's upcoming chests"""
+        return await self._call('get_upcoming_chests', player_tag)
+
+    async def get_players(self, player_tags):
+        """Yield (player_tag, result) for each player as its lookup completes"""
+        async for item in self._bulk('get_player', player_tags):
+            yield item
+
+    async def get_player_snapshots(self, player_tags):
+        """Yield (player_tag, result) for each player as its lookup completes, with PlayerSnapshot data"""
+        async for item in self._bulk('get_player_snapshot', player_tags):
+            yield item
+
+    async def get_battlelogs(self, player_tags):
+        """Yield (player_tag, result) for each player's battlelog as it completes"""
+        async for item in self._bulk('get_battlelog', player_tags):
+            yield item
+
+    async def _bulk(self, method, player_tags):
+        async def fetch(player_tag):
+            return player_tag, await self._call(method, player_tag)
+
+        tasks = [asyncio.ensure_future(fetch(player_tag)) for player_tag in player_tags]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # A caller that stops iterating early doesn't leave requests queued
+            for task in tasks:
+                task.cancel()
+
+
+async def refresh_players(store, player_tags, concurrency=CONCURRENCY, api=None):
+    """Fetch every player's current stats and save them; returns (saved, failed) counts"""
+    saved = failed = 0
+    async with AsyncClashRoyaleAPI(concurrency=concurrency, api=api) as client:
+        # Saving reads a few dozen fields, so the large sections are never decoded
+        async for player_tag, result in client.get_player_snapshots(player_tags):
+            if not result['success']:
+                print(f"Error fetching {player_tag}: {result['error']}")
+                failed += 1
+                continue
+            try:
+                store.save_stats(player_tag, result['data'])
+                saved += 1
+            except Exception as e:
+                print(f"Error saving stats for {player_tag}: {e}")
+                failed += 1
+    return saved, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh the stats of every tracked player')
+    parser.add_argument('--data-dir', default='data', help='Stats data directory')
+    parser.add_argument('--backend', default='parquet', help='Stats storage backend')
+    parser.add_argument('--players', help='Comma-separated player tags to refresh (default: all tracked players)')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='Requests in flight at once')
+    args = parser.parse_args()
+
+    from data_store import PlayerStatsStore
+    # Buffered so a refresh writes a few Parquet files rather than one per player
+    store = PlayerStatsStore(args.data_dir, backend=args.backend, buffered=True)
+    player_tags = args.players.split(',') if args.players else store.get_all_tracked_players()
+    started = time.monotonic()
+    saved, failed = asyncio.run(refresh_players(store, player_tags, args.concurrency))
+    print(f"Refreshed {saved} players ({failed} failed) in {time.monotonic() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
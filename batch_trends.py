@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Trends for every tracked player over several windows in one vectorized pass"""
+
+import argparse
+import math
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from stats_backends import EPOCH
+from stats_retention import MarkerFiller, period_starts, roll_up, to_rollup
+from trend_summary import TREND_FIELDS
+
+# Windows trends are computed over; a season runs from the first Monday of the month
+TREND_WINDOWS = ('24h', '7d', '30d', 'season')
+WINDOW_SPANS = {'24h': timedelta(hours=24), '7d': timedelta(days=7), '30d': timedelta(days=30)}
+
+# Fields of each trend, as calculate_trends returns them
+TREND_RESULT_FIELDS = ('trophy_change', 'win_change', 'loss_change', 'three_crown_change',
+                       'days_tracked', 'data_points', 'win_rate')
+
+# Hourly rollup columns the trends are computed from: each hour's last
+# snapshot, its first and how many there were
+READ_COLUMNS = ['player_tag', 'timestamp', 'snapshots', *TREND_FIELDS,
+                'timestamp_first', *[f"{name}_first" for name in TREND_FIELDS]]
+
+
+def season_start(now):
+    """Start of the Clash Royale season a time falls in: the first Monday of its month, or of the month before"""
+    month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    start = month + timedelta(days=-month.weekday() % 7)
+    if start > now:
+        month = (month - timedelta(days=1)).replace(day=1)
+        start = month + timedelta(days=-month.weekday() % 7)
+    return start
+
+
+def window_start(window, now):
+    """When a trend window that ends at now starts"""
+    if window == 'season':
+        return season_start(now)
+    if window not in WINDOW_SPANS:
+        raise ValueError(f"Unknown trend window {window!r}, expected one of {TREND_WINDOWS}")
+    return now - WINDOW_SPANS[window]
+
+
+def _micros(timestamp):
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def _player_codes(table):
+    """Unify a table's player_tag dictionaries; returns the table, the dictionary and each row's code in it"""
+    table = table.unify_dictionaries()
+    tags = table.column('player_tag')
+    dictionary = tags.chunk(0).dictionary
+    codes = np.concatenate([chunk.indices.to_numpy(zero_copy_only=False) for chunk in tags.chunks]).astype(np.intp)
+    return table, dictionary, codes
+
+
+def _latest_rows(codes, players):
+    """Index of each player code's last row, -1 where a code has none"""
+    latest = np.full(players, -1)
+    np.maximum.at(latest, codes, np.arange(len(codes)))
+    return latest
+
+
+def _read_hourly(store, since):
+    """Every player's hourly rollups from since on, in time order within each player
+
+    The stored tier is read up to its watermark; raw snapshots after it are
+    rolled up on the fly.
+    """
+    rollups = store.rollups
+    tier = rollups.tiers['hourly']
+    watermark = rollups.watermark('hourly')
+    tables = []
+    if watermark is not None and since < watermark:
+        tables.append(tier.read(since=since, before=watermark, columns=READ_COLUMNS))
+        since = watermark
+
+    raw = store.backend.read_range(since=since, columns=['player_tag', *TREND_FIELDS])
+    if raw.num_rows:
+        # Markers after the watermark take their values from each player's
+        # last stored rollup, which was just read anyway
+        carry = None
+        if tables and tables[0].num_rows:
+            stored, dictionary, codes = _player_codes(tables[0])
+            latest = _latest_rows(codes, len(dictionary))
+            carry = stored.take(latest[latest >= 0]).select([name for name in raw.column_names if name != 'unchanged'])
+            carry = carry.append_column('unchanged', pa.array(np.zeros(carry.num_rows, dtype=bool))).cast(raw.schema)
+            tables[0] = stored
+        filled = MarkerFiller(tier, carry).fill(raw, since)
+        tables.append(roll_up(to_rollup(filled), 'hour').select(READ_COLUMNS))
+    tables = [table.cast(tables[0].schema) for table in tables]
+    return pa.concat_tables(tables) if tables else None
+
+
+def compute_trends(store, windows=TREND_WINDOWS, now=None):
+    """Trends for every player over each window, as {window: Arrow table}
+
+    Each table has a player_tag column plus the calculate_trends fields, with
+    one row per player that has at least two snapshots in the window. All
+    windows come from a single read of hourly rollups: every player's
+    newest row, first row in each window and snapshot counts are found with
+    grouped numpy reductions over the player_tag dictionary codes. Like the
+    trend summaries, a window covers the hours whose first snapshot is at
+    or after its start, so it can be up to an hour shorter than the exact
+    window.
+    """
+    now = now or datetime.now()
+    starts = {window: window_start(window, now) for window in windows}
+    empty = {window: _trend_table(pa.array([], pa.string()), {}) for window in windows}
+    if not starts:
+        return empty
+    # From the top of the hour, so the hour straddling the earliest start is rolled up whole
+    table = _read_hourly(store, min(starts.values()).replace(minute=0, second=0, microsecond=0))
+    if table is None or table.num_rows == 0:
+        return empty
+
+    # Rows of one player share a dictionary code once dictionaries are unified
+    table, dictionary, codes = _player_codes(table)
+    snapshots = table.column('snapshots').to_numpy().astype(np.int64)
+    values = {name: pc.cast(table.column(name), pa.float64()).to_numpy() for name in TREND_FIELDS}
+    starts_table = period_starts(table)
+    first_times = starts_table.column('timestamp').to_numpy().astype(np.int64)
+    first_values = {name: pc.cast(starts_table.column(name), pa.float64()).to_numpy() for name in TREND_FIELDS}
+
+    # Rows are in time order within each player, so the newest is the last one
+    latest = _latest_rows(codes, len(dictionary))
+
+    result = {}
+    for window, start in starts.items():
+        in_window = np.flatnonzero(first_times >= _micros(start))
+        oldest = np.full(len(dictionary), table.num_rows)
+        np.minimum.at(oldest, codes[in_window], in_window)
+        data_points = np.bincount(codes[in_window], weights=snapshots[in_window], minlength=len(dictionary))
+
+        players = np.flatnonzero(data_points >= 2)
+        first, last = oldest[players], latest[players]
+        changes = {name: values[name][last] - first_values[name][first] for name in TREND_FIELDS}
+        days = WINDOW_SPANS[window].days if window in WINDOW_SPANS else math.ceil((now - start) / timedelta(days=1))
+        columns = {
+            'trophy_change': changes['trophies'],
+            'win_change': changes['wins'],
+            'loss_change': changes['losses'],
+            'three_crown_change': changes['three_crown_wins'],
+            'days_tracked': np.full(len(players), days),
+            'data_points': data_points[players],
+        }
+        result[window] = _trend_table(dictionary.take(pa.array(players)), columns)
+    return result
+
+
+def _trend_table(player_tags, columns):
+    """Arrow table of trends; win_rate is derived from the win and loss changes"""
+    arrays = {'player_tag': player_tags.cast(pa.string())}
+    for name in TREND_RESULT_FIELDS:
+        if name == 'win_rate':
+            continue
+        # Changes are NaN where a stat is missing
+        values = columns.get(name, np.empty(0))
+        arrays[name] = pa.array(values, mask=np.isnan(values.astype(np.float64))).cast(pa.int64())
+
+    wins, losses = arrays['win_change'], arrays['loss_change']
+    battles = pc.add(wins, losses)
+    win_rate = pc.round(pc.multiply(pc.divide(pc.cast(wins, pa.float64()), battles), 100), 1)
+    arrays['win_rate'] = pc.if_else(pc.greater(battles, 0), win_rate, pa.scalar(None, pa.float64()))
+    return pa.table({name: arrays[name] for name in ('player_tag', *TREND_RESULT_FIELDS)})
+
+
+def leaderboard(trends, sort='trophy_change', descending=True, limit=100):
+    """The top rows of one window's trend table as dicts, players with no value last"""
+    if sort not in TREND_RESULT_FIELDS:
+        raise ValueError(f"Unknown trend field {sort!r}, expected one of {TREND_RESULT_FIELDS}")
+    direction = 'descending' if descending else 'ascending'
+    order = pc.sort_indices(trends, sort_keys=[(sort, direction, 'at_end'), ('player_tag', 'ascending', 'at_end')])
+    return trends.take(order.slice(0, limit)).to_pylist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-dir', default='data', help='Stats data directory')
+    parser.add_argument('--backend', default='parquet', help='Stats storage backend')
+    parser.add_argument('--window', choices=TREND_WINDOWS, default='7d', help='Window to rank players over')
+    parser.add_argument('--sort', choices=TREND_RESULT_FIELDS, default='trophy_change', help='Field to rank players by')
+    parser.add_argument('--limit', type=int, default=20, help='Players to show')
+    args = parser.parse_args()
+
+    from data_store import PlayerStatsStore
+    store = PlayerStatsStore(args.data_dir, backend=args.backend)
+    started = time.monotonic()
+    trends = compute_trends(store)
+    print(f"Computed trends for {trends[args.window].num_rows} players in {time.monotonic() - started:.2f}s")
+    for rank, row in enumerate(leaderboard(trends[args.window], args.sort, limit=args.limit), 1):
+        win_rate = f"{row['win_rate']}%" if row['win_rate'] is not None else '-'
+        print(f"{rank:>3}. {row['player_tag']:<14} {args.sort} {row[args.sort]:>6}  win rate {win_rate}")
+
+
+if __name__ == '__main__':
+    main()
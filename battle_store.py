@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""Battlelog ingestion into a date-partitioned Parquet table of one row per battle"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from async_cr_api import AsyncClashRoyaleAPI, CONCURRENCY
+from cr_api import normalize_tag
+from file_lock import file_lock
+from parquet_backend import READ_ATTEMPTS, write_fragment
+
+# One row per battle, seen from the side of the tracked player it was first
+# ingested for. Decks are the card ids of every player on a side, in order,
+# with their levels alongside.
+BATTLE_SCHEMA = pa.schema([
+    ('battle_id', pa.int64()),
+    ('battle_time', pa.timestamp('us')),
+    ('type', pa.dictionary(pa.int8(), pa.string())),
+    ('game_mode', pa.dictionary(pa.int16(), pa.string())),
+    ('arena_id', pa.int32()),
+    ('team_tags', pa.list_(pa.string())),
+    ('opponent_tags', pa.list_(pa.string())),
+    ('team_crowns', pa.int8()),
+    ('opponent_crowns', pa.int8()),
+    ('starting_trophies', pa.int32()),
+    ('trophy_change', pa.int16()),
+    ('team_cards', pa.list_(pa.int32())),
+    ('team_card_levels', pa.list_(pa.int8())),
+    ('opponent_cards', pa.list_(pa.int32())),
+    ('opponent_card_levels', pa.list_(pa.int8())),
+])
+
+# Files are laid out Hive-style as battles/date=YYYY-MM-DD/part-*.parquet,
+# dated by battle time (UTC)
+WRITE_OPTIONS = {
+    'use_dictionary': ['type', 'game_mode'],
+    'write_statistics': ['battle_id', 'battle_time'],
+}
+
+# Battle ids are remembered this long to drop battles seen from another player's log;
+# battlelogs only hold a player's last 25 battles, so older ones don't come back
+SEEN_DAYS = 30
+
+# Only merge a date partition's files once it has this many
+MIN_FRAGMENTS = 8
+
+BATTLE_TIME_FORMAT = '%Y%m%dT%H%M%S.%fZ'
+
+
+def _micros(timestamp):
+    return (timestamp - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+
+
+def battle_time(battle):
+    """When a battle was played, as a naive UTC datetime"""
+    return datetime.strptime(battle['battleTime'], BATTLE_TIME_FORMAT)
+
+
+def battle_id(battle):
+    """Stable 64-bit id of a battle: its time and the sorted tags of everyone in it
+
+    The same battle has the same id in every participant's battlelog.
+    """
+    tags = sorted(player['tag'] for player in battle.get('team', []) + battle.get('opponent', []))
+    digest = hashlib.blake2b('|'.join([battle['battleTime'], *tags]).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def _side(players):
+    cards = [card for player in players for card in player.get('cards', [])]
+    return (
+        [player['tag'] for player in players],
+        players[0].get('crowns') if players else None,
+        [card['id'] for card in cards],
+        [card.get('level') for card in cards],
+    )
+
+
+def battle_row(battle):
+    """A battlelog entry as a BATTLE_SCHEMA row"""
+    team, opponent = battle.get('team', []), battle.get('opponent', [])
+    team_tags, team_crowns, team_cards, team_levels = _side(team)
+    opponent_tags, opponent_crowns, opponent_cards, opponent_levels = _side(opponent)
+    return {
+        'battle_id': battle_id(battle),
+        'battle_time': battle_time(battle),
+        'type': battle.get('type'),
+        'game_mode': battle.get('gameMode', {}).get('name'),
+        'arena_id': battle.get('arena', {}).get('id'),
+        'team_tags': team_tags,
+        'opponent_tags': opponent_tags,
+        'team_crowns': team_crowns,
+        'opponent_crowns': opponent_crowns,
+        'starting_trophies': team[0].get('startingTrophies') if team else None,
+        'trophy_change': team[0].get('trophyChange') if team else None,
+        'team_cards': team_cards,
+        'team_card_levels': team_levels,
+        'opponent_cards': opponent_cards,
+        'opponent_card_levels': opponent_levels,
+    }
+
+
+class BattleStore:
+    """Battles in a Hive-partitioned Parquet dataset plus a small SQLite index
+
+    The index (WAL mode) holds each player's watermark, the time of the
+    newest battle ingested from their log, and the ids of recent battles.
+    Battles at or before a player's watermark are skipped without touching
+    anything, so re-ingesting a log does no work; ids catch the same battle
+    arriving through another tracked player's log. New battles are written
+    inside the index transaction, so concurrent ingesters never both write a
+    battle; a crash between writing and committing can leave a duplicate,
+    which read() drops.
+    """
+
+    def __init__(self, data_dir='data'):
+        self.data_dir = Path(data_dir)
+        self.dataset_dir = self.data_dir / 'battles'
+        self.index_path = self.data_dir / 'battles_index.sqlite'
+        self.data_dir.mkdir(exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS watermarks ("
+                "player_tag TEXT PRIMARY KEY, "
+                "last_battle INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen ("
+                "battle_id INTEGER PRIMARY KEY, "
+                "battle_time INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_seen_battle_time ON seen (battle_time)")
+
+    def _connect(self):
+        """Per-thread connection; sqlite3 connections can't be shared between threads"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _watermarks(self, conn, player_tags):
+        rows = conn.execute(
+            f"SELECT player_tag, last_battle FROM watermarks WHERE player_tag IN ({','.join('?' * len(player_tags))})",
+            player_tags,
+        ).fetchall()
+        return dict(rows)
+
+    def _unseen(self, battlelogs, watermarks):
+        """Each player's battles newer than their watermark, as {player_tag: [(micros, battle)]}"""
+        unseen = {}
+        for player_tag, battlelog in battlelogs.items():
+            watermark = watermarks.get(player_tag, -1)
+            battles = [(_micros(battle_time(battle)), battle) for battle in battlelog]
+            battles = [(micros, battle) for micros, battle in battles if micros > watermark]
+            if battles:
+                unseen[player_tag] = battles
+        return unseen
+
+    def ingest(self, player_tag, battlelog):
+        """Store the battles of one player's battlelog not stored yet; returns how many were new"""
+        return self.ingest_many({player_tag: battlelog})
+
+    def ingest_many(self, battlelogs):
+        """Store the battles of many players' battlelogs ({player_tag: battlelog}) in one write
+
+        Returns the number of new battles; each date they fall on gets one new file.
+        """
+        battlelogs = {normalize_tag(player_tag): battlelog for player_tag, battlelog in battlelogs.items()}
+        conn = self._connect()
+        player_tags = list(battlelogs)
+        # Logs with nothing past their watermark are dropped before taking the write lock
+        if not self._unseen(battlelogs, self._watermarks(conn, player_tags)):
+            return 0
+
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Re-read under the lock: another ingester may have moved the watermarks
+            unseen = self._unseen(battlelogs, self._watermarks(conn, player_tags))
+            rows = []
+            for player_tag, battles in unseen.items():
+                for micros, battle in battles:
+                    row = battle_row(battle)
+                    inserted = conn.execute(
+                        "INSERT OR IGNORE INTO seen (battle_id, battle_time) VALUES (?, ?)",
+                        (row['battle_id'], micros),
+                    ).rowcount
+                    if inserted:
+                        rows.append(row)
+                conn.execute(
+                    "INSERT INTO watermarks (player_tag, last_battle) VALUES (?, ?) "
+                    "ON CONFLICT (player_tag) DO UPDATE SET last_battle = MAX(last_battle, excluded.last_battle)",
+                    (player_tag, max(micros for micros, _ in battles)),
+                )
+            if rows:
+                self._write(rows)
+            cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=SEEN_DAYS)
+            conn.execute("DELETE FROM seen WHERE battle_time < ?", (_micros(cutoff),))
+        return len(rows)
+
+    def _write(self, rows):
+        table = pa.Table.from_pylist(rows, schema=BATTLE_SCHEMA)
+        dates = pc.strftime(table.column('battle_time'), format='%Y-%m-%d')
+        for date in pc.unique(dates).to_pylist():
+            day = table.filter(pc.equal(dates, date)).sort_by('battle_time')
+            write_fragment(self.dataset_dir / f"date={date}", day, **WRITE_OPTIONS)
+
+    def _date_paths(self, since=None, until=None):
+        paths = []
+        for date_dir in sorted(self.dataset_dir.glob('date=*')):
+            day = date_dir.name.split('=', 1)[1]
+            if since is not None and day < f"{since:%Y-%m-%d}":
+                continue
+            if until is not None and day > f"{until:%Y-%m-%d}":
+                continue
+            paths.extend(str(path) for path in sorted(date_dir.glob('*.parquet')))
+        return paths
+
+    def read(self, since=None, until=None, player_tag=None, columns=None):
+        """Battles with since <= battle_time < until (UTC), optionally only a player's, oldest first"""
+        filter = None
+        if since is not None:
+            filter = ds.field('battle_time') >= pa.scalar(since, pa.timestamp('us'))
+        if until is not None:
+            before = ds.field('battle_time') < pa.scalar(until, pa.timestamp('us'))
+            filter = before if filter is None else filter & before
+        for attempt in range(READ_ATTEMPTS):
+            paths = self._date_paths(since, until)
+            if not paths:
+                return BATTLE_SCHEMA.empty_table().select(columns or BATTLE_SCHEMA.names)
+            try:
+                table = ds.dataset(paths, format='parquet', schema=BATTLE_SCHEMA).to_table(filter=filter)
+                break
+            except FileNotFoundError:
+                # Compaction replaced a partition's files mid-read; list them again
+                if attempt == READ_ATTEMPTS - 1:
+                    raise
+
+        if player_tag is not None:
+            mask = pc.or_(self._involves(table.column('team_tags'), player_tag),
+                          self._involves(table.column('opponent_tags'), player_tag))
+            table = table.filter(mask)
+        table = table.sort_by([('battle_time', 'ascending'), ('battle_id', 'ascending')])
+        # A battle written twice (see the class docstring) keeps one copy
+        ids = table.column('battle_id').to_numpy()
+        if len(ids) > 1 and (ids[1:] == ids[:-1]).any():
+            table = table.filter(pa.array(np.concatenate([[True], ids[1:] != ids[:-1]])))
+        return table.select(columns or BATTLE_SCHEMA.names)
+
+    @staticmethod
+    def _involves(tags, player_tag):
+        """Which rows of a list<string> column contain a tag"""
+        tags = tags.combine_chunks()
+        matches = pc.equal(pc.list_flatten(tags), player_tag)
+        rows = pc.list_parent_indices(tags).filter(matches)
+        return pc.is_in(pa.array(np.arange(len(tags), dtype=np.int64)), value_set=pc.unique(rows))
+
+    def compact(self, min_fragments=MIN_FRAGMENTS):
+        """Merge the files of every date partition that has at least min_fragments; returns partitions merged"""
+        merged = 0
+        # Two workers merging the same partition would each write a copy
+        with file_lock(self.data_dir / '.battles_compaction.lock'):
+            for date_dir in sorted(self.dataset_dir.glob('date=*')):
+                paths = sorted(date_dir.glob('*.parquet'))
+                if len(paths) < min_fragments:
+                    continue
+                table = ds.dataset([str(path) for path in paths], format='parquet', schema=BATTLE_SCHEMA).to_table()
+                write_fragment(date_dir, table.sort_by('battle_time'), prefix='compacted', **WRITE_OPTIONS)
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                merged += 1
+        return merged
+
+
+async def poll_battlelogs(battles, player_tags, concurrency=CONCURRENCY, api=None, batch_size=500):
+    """Fetch players' battlelogs and ingest them batch_size logs at a time; returns (new battles, failed logs)"""
+    new = failed = 0
+    batch = {}
+    async with AsyncClashRoyaleAPI(concurrency=concurrency, api=api) as client:
+        async for player_tag, result in client.get_battlelogs(player_tags):
+            if not result['success']:
+                print(f"Error fetching battlelog for {player_tag}: {result['error']}")
+                failed += 1
+                continue
+            batch[player_tag] = result['data']
+            if len(batch) >= batch_size:
+                new += battles.ingest_many(batch)
+                batch = {}
+    if batch:
+        new += battles.ingest_many(batch)
+    return new, failed
+
+
+def poll_tracked(battles, player_tags, concurrency=CONCURRENCY, api=None, max_age=None):
+    """Poll players' battlelogs and compact the new files; returns (new battles, failed logs)
+
+    With max_age, skip the poll when another worker finished one less than
+    that many seconds ago and return None.
+    """
+    # Workers polling together would each fetch every log; the stamp's mtime
+    # marks when the last poll finished
+    stamp_path = battles.data_dir / '.battles_polled'
+    with file_lock(battles.data_dir / '.battles_poll.lock'):
+        if max_age is not None and stamp_path.exists() and time.time() - stamp_path.stat().st_mtime < max_age:
+            return None
+        try:
+            new, failed = asyncio.run(poll_battlelogs(battles, player_tags, concurrency, api))
+            battles.compact()
+        finally:
+            stamp_path.touch()
+    return new, failed
+
+
+class BattlelogScheduler:
+    """Poll every tracked player's battlelog periodically on a background thread"""
+
+    def __init__(self, store, battles, interval=600, concurrency=CONCURRENCY, api=None):
+        self.store = store
+        self.battles = battles
+        self.interval = interval
+        self.concurrency = concurrency
+        self.api = api
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='battlelog-poll', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ask the background thread to exit"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                # Every worker runs a scheduler; only the first one each interval polls
+                player_tags = self.store.get_all_tracked_players()
+                polled = poll_tracked(self.battles, player_tags, self.concurrency, self.api, max_age=self.interval / 2)
+                if polled is not None:
+                    new, failed = polled
+                    print(f"Ingested {new} new battles from {len(player_tags)} battlelogs ({failed} failed)")
+            except Exception as e:
+                print(f"Error polling battlelogs: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-dir', default='data', help='Stats data directory')
+    parser.add_argument('--backend', default='parquet', help='Stats storage backend (for the tracked players)')
+    parser.add_argument('--players', help='Comma-separated player tags to poll (default: all tracked players)')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='Requests in flight at once')
+    parser.add_argument('--interval', type=int, default=0, help='Keep polling every this many seconds (0 = poll once)')
+    args = parser.parse_args()
+
+    from data_store import PlayerStatsStore
+    store = PlayerStatsStore(args.data_dir, backend=args.backend)
+    battles = BattleStore(args.data_dir)
+    while True:
+        player_tags = args.players.split(',') if args.players else store.get_all_tracked_players()
+        started = time.monotonic()
+        new, failed = poll_tracked(battles, player_tags, args.concurrency)
+        print(f"Ingested {new} new battles from {len(player_tags)} battlelogs ({failed} failed) "
+              f"in {time.monotonic() - started:.2f}s")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Benchmark concurrent lookups of one player with and without single-flight coalescing
+
+Starts the mock Clash Royale API (mock_cr_api.py), which counts requests,
+then has N threads (and N coroutines) look up the same player at once, each
+fetching it and saving a snapshot to a scratch stats store.
+"""
+
+import argparse
+import asyncio
+import tempfile
+import threading
+import time
+from async_cr_api import AsyncClashRoyaleAPI
+from cr_api import ClashRoyaleAPI, create_session, normalize_tag
+from data_store import PlayerStatsStore
+from mock_cr_api import MockClashRoyaleAPI, player_tags, start_server
+from single_flight import SingleFlight
+
+
+def _snapshots(store, player_tag):
+    entry = next((entry for entry in store.list_tracked_players() if entry['player_tag'] == player_tag), None)
+    return entry['snapshot_count'] if entry else 0
+
+
+def bench_threads(api, store, player_tag, concurrency, flights):
+    """Look the player up from `concurrency` threads at once; returns the seconds taken"""
+    def lookup():
+        result = api.get_player(player_tag)
+        store.save_stats(player_tag, result['data'])
+        return result
+
+    barrier = threading.Barrier(concurrency)
+
+    def worker():
+        barrier.wait()
+        if flights is None:
+            lookup()
+        else:
+            flights.do(normalize_tag(player_tag), lookup)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - started
+
+
+async def bench_async(api, player_tag, concurrency):
+    """Look the player up from `concurrency` coroutines at once; returns the seconds taken"""
+    async with AsyncClashRoyaleAPI(api=api, concurrency=concurrency) as client:
+        started = time.monotonic()
+        await asyncio.gather(*[client.get_player(player_tag) for _ in range(concurrency)])
+        return time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=50, help='Simultaneous lookups of the player')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds the stand-in API takes to answer')
+    args = parser.parse_args()
+
+    mock = MockClashRoyaleAPI(latency=args.latency)
+    server, base_url = start_server(mock)
+    requests = mock.requests
+    api = ClashRoyaleAPI('bench', session=create_session(pool_size=args.concurrency), rate_limit=0)
+    api.BASE_URL = base_url
+    player_tag = player_tags(1)[0]
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = PlayerStatsStore(data_dir, backend='sqlite')
+        for name, flights in (('without single-flight', None), ('with single-flight', SingleFlight())):
+            requests.clear()
+            saved = _snapshots(store, player_tag)
+            elapsed = bench_threads(api, store, player_tag, args.concurrency, flights)
+            print(f"{args.concurrency} threads {name}: {requests['player']} upstream calls, "
+                  f"{_snapshots(store, player_tag) - saved} store writes, {elapsed:.2f}s")
+
+    requests.clear()
+    elapsed = asyncio.run(bench_async(api, player_tag, args.concurrency))
+    print(f"{args.concurrency} coroutines with AsyncClashRoyaleAPI: {requests['player']} upstream calls, {elapsed:.2f}s")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -25,13 +25,16 @@ def update_cards_from_player_data():
     cards_dict = load_cards_master()
     updated = False
 
-    # Read the player stats parquet file
-    stats_file = DATA_DIR / 'player_stats.parquet'
-    if not stats_file.exists():
+    # Read the partitioned player stats dataset
+    stats_dir = DATA_DIR / 'player_stats'
+    if not stats_dir.exists():
         return cards_dict
 
     try:
-        df = pd.read_parquet(stats_file)
+        df = pd.read_parquet(stats_dir)
+        # Unchanged marker rows only hold a timestamp and player tag
+        if 'unchanged' in df.columns:
+            df = df[df['unchanged'] != True]
 
         # Get the most recent entry for any player (they all have the same full card list)
         if len(df) > 0:
@@ -1,17 +1,54 @@
-"""Data storage and historical tracking using Parquet"""
+"""Data storage and historical tracking"""
 
-import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from datetime import datetime
 from pathlib import Path
+from hot_cache import HotStatsCache
+from parquet_backend import ParquetStatsBackend
+from player_registry import PlayerRegistry
+from player_snapshot import card_count
+from stats_backends import StatsBackend, SQLiteStatsBackend, STATS_SCHEMA, TREND_COLUMNS, fill_unchanged
+from stats_export import iter_export_tables
+from stats_retention import StatsRollups, period_starts, rollup_columns, roll_up, to_rollup
+from trend_summary import TrendSummaryStore, SUMMARY_WINDOWS, build_trends, same_snapshot
+
+# Backends PlayerStatsStore can be configured with by name
+BACKENDS = ('parquet', 'sqlite')
+
 
 class PlayerStatsStore:
-    """Store and retrieve player stats using Parquet files"""
+    """Store and retrieve player stats through a pluggable storage backend
+
+    backend is 'parquet' (partitioned Parquet dataset, the default),
+    'sqlite' (indexed SQLite database in WAL mode) or any StatsBackend
+    instance, e.g. a FirestoreStatsBackend. The buffering options only
+    apply to the Parquet backend. With hot_cache_days, raw reads of recent
+    history are served from a memory-mapped Arrow file (see hot_cache.py).
+    """
 
-    def __init__(self, data_dir='data'):
+    def __init__(self, data_dir='data', backend='parquet', buffered=False, flush_rows=500, flush_interval=5.0,
+                 hot_cache_days=0):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True)
-        self.stats_file = self.data_dir / 'player_stats.parquet'
+
+        if isinstance(backend, StatsBackend):
+            self.backend = backend
+        elif backend == 'parquet':
+            self.backend = ParquetStatsBackend(self.data_dir, buffered, flush_rows, flush_interval)
+        elif backend == 'sqlite':
+            self.backend = SQLiteStatsBackend(self.data_dir / 'player_stats.sqlite')
+        else:
+            raise ValueError(f"Unknown stats backend {backend!r}, expected one of {BACKENDS}")
+
+        self.summaries = TrendSummaryStore(self.data_dir / 'trend_summaries')
+        self.rollups = StatsRollups(self.data_dir)
+        self.hot_cache = HotStatsCache(self.data_dir / 'hot_cache.arrow', hot_cache_days) if hot_cache_days else None
+
+        self.registry = PlayerRegistry(self.data_dir / 'player_registry.sqlite')
+        self.registry.fill_once(self.backend)
 
     def save_stats(self, player_tag, player_data):
         """Save player stats with timestamp - tracking ALL key metrics"""
@@ -51,88 +88,227 @@ class PlayerStatsStore:
             'clan_cards_collected': player_data.get('clanCardsCollected', 0),
 
             # Card collection stats (changes as cards upgrade)
-            'total_cards': len(player_data.get('cards', [])),
+            'total_cards': card_count(player_data),
             'star_points': player_data.get('starPoints', 0),
         }
 
-        # Create DataFrame
-        new_df = pd.DataFrame([stats])
-
-        # Append to existing data or create new file
-        if self.stats_file.exists():
-            existing_df = pd.read_parquet(self.stats_file)
-            combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-        else:
-            combined_df = new_df
-
-        # Save to Parquet
-        combined_df.to_parquet(self.stats_file, index=False, engine='pyarrow')
+        with self.summaries.lock(player_tag):
+            # Stamped under the lock so each player's snapshots are stored in order
+            stats['timestamp'] = datetime.now()
+            summary = self.summaries.get(player_tag)
+            if summary is None and self.registry.seen(player_tag):
+                # Players tracked before summaries existed get theirs from history
+                summary = self.summaries.build(self, player_tag)
+            if summary and same_snapshot(summary.get('latest'), stats):
+                # Nothing changed since the last save; store a marker row instead
+                self.backend.append([{'timestamp': stats['timestamp'], 'player_tag': player_tag, 'unchanged': True}])
+            else:
+                self.backend.append([stats])
+            self.summaries.update_locked(stats, summary)
+        self.registry.record(stats)
 
         return stats
 
-    def get_player_history(self, player_tag, limit=None):
-        """Get historical stats for a player"""
-        if not self.stats_file.exists():
+    def get_player_history(self, player_tag, limit=None, since=None, until=None, columns=None, resolution='raw'):
+        """Get historical stats for a player, newest first
+
+        resolution is 'raw' (every snapshot, the default), 'hourly' or
+        'daily' (one row per period: its last snapshot plus a snapshot count,
+        min/max per stat and its first snapshot as *_first columns), or None
+        for the coarsest one that answers the query. The player_tag and
+        timestamp range are pushed down to the storage layer, and only the
+        requested columns are read.
+        """
+        table = self.read_history(player_tag, limit=limit, since=since, until=until, columns=columns, resolution=resolution)
+        if table.num_rows == 0:
             return pd.DataFrame()
 
-        df = pd.read_parquet(self.stats_file)
-        player_df = df[df['player_tag'] == player_tag].sort_values('timestamp', ascending=False)
+        player_df = table.to_pandas().sort_values('timestamp', ascending=False, ignore_index=True)
 
         if limit:
             player_df = player_df.head(limit)
 
         return player_df
 
+    def read_history(self, player_tag, limit=None, since=None, until=None, columns=None, resolution='raw',
+                     oldest=False):
+        """Historical stats for a player as an Arrow table, oldest first
+
+        Takes the same arguments as get_player_history. A limit keeps the
+        newest rows, or the oldest ones with oldest=True, and may return a
+        few more rows than asked for. Recent raw history comes from the hot
+        cache as zero-copy slices.
+        """
+        if resolution is None:
+            resolution = self._pick_resolution(player_tag, limit, since, until)
+        if resolution == 'raw':
+            table = self._read_raw(player_tag, since=since, until=until, columns=columns, limit=limit, oldest=oldest)
+        else:
+            table = self._read_rollup(player_tag, resolution, since=since, until=until, columns=columns).sort_by('timestamp')
+
+        # A Parquet reader racing compaction can see a fragment and its compacted copy
+        timestamps = table.column('timestamp').to_numpy()
+        repeated = timestamps[1:] == timestamps[:-1]
+        if repeated.any():
+            table = table.filter(pa.array(np.concatenate([[True], ~repeated])))
+        return table
+
+    def _pick_resolution(self, player_tag, limit=None, since=None, until=None):
+        # The newest few snapshots always come from raw history
+        if since is None and limit:
+            return 'raw'
+        since = since or self.registry.first_seen(player_tag)
+        return self.rollups.pick_resolution(since, until) if since else 'raw'
+
+    def _read_raw(self, player_tag, since=None, until=None, columns=None, limit=None, oldest=False):
+        """Raw snapshots, oldest first, with unchanged markers filled in"""
+        # The hot cache fills a limit with the newest rows
+        table = self._read_hot(player_tag, since=since, until=until, columns=columns, limit=None if oldest else limit)
+        if table is not None:
+            return table
+        table = self.backend.read_player(player_tag, since=since, until=until, columns=columns, limit=limit, oldest=oldest)
+        if table.num_rows:
+            table = self._fill_unchanged(player_tag, table)
+        return table.drop_columns(['unchanged'])
+
+    def _read_hot(self, player_tag, since=None, until=None, columns=None, limit=None):
+        """Raw snapshots from the hot cache plus any stored since it was built, or None if it can't answer"""
+        if self.hot_cache is None:
+            return None
+        seen = self.registry.seen(player_tag)
+        if since is None and seen:
+            since = seen[0]
+        cached = self.hot_cache.read(player_tag, since=since, until=until, columns=columns, limit=limit)
+        if cached is None:
+            return None
+
+        # Saves are registered once stored, so the registry tells whether anything newer exists
+        table, cached_until = cached
+        if (until is not None and until < cached_until) or (seen and seen[1] < cached_until):
+            return table
+        tail = self.backend.read_player(player_tag, since=cached_until, until=until, columns=columns)
+        if tail.num_rows == 0:
+            return table
+        base = self.hot_cache.last_row(player_tag, tail.column_names)
+        tail = self._fill_unchanged(player_tag, tail, base=base).drop_columns(['unchanged'])
+        return pa.concat_tables([table, tail.select(table.column_names)])
+
+    def _read_rollup(self, player_tag, resolution, since=None, until=None, columns=None):
+        """Rollup rows: the stored tier up to its watermark, rolled up on the fly after it"""
+        tier = self.rollups.tiers[resolution]
+        watermark = self.rollups.watermark(resolution)
+        tables = []
+        if watermark is not None and (since is None or since < watermark):
+            tables.append(tier.read(player_tag, since=since, until=until, before=watermark, columns=rollup_columns(columns)))
+            since = watermark
+
+        if until is None or since is None or since <= until:
+            if resolution == 'hourly':
+                finer = to_rollup(self._read_raw(player_tag, since=since, until=until, columns=columns))
+            else:
+                finer = self._read_rollup(player_tag, 'hourly', since=since, until=until, columns=columns)
+            tables.append(roll_up(finer.sort_by('timestamp'), tier.unit))
+
+        names = tables[0].column_names
+        return pa.concat_tables([table.select(names) for table in tables])
+
     def get_latest_stats(self, player_tag):
         """Get most recent stats for a player"""
-        history = self.get_player_history(player_tag, limit=1)
-        if history.empty:
+        table = self.backend.read_latest(player_tag)
+        if table.num_rows:
+            table = self._fill_unchanged(player_tag, table).drop_columns(['unchanged'])
+        else:
+            # Raw history may have aged out; rollups keep the last snapshot of each period
+            for resolution in ('hourly', 'daily'):
+                table = self.rollups.tiers[resolution].latest_before([player_tag], datetime.now())
+                if table.num_rows:
+                    table = table.select([name for name in STATS_SCHEMA.names if name != 'unchanged'])
+                    break
+        if table.num_rows == 0:
             return None
-        return history.iloc[0].to_dict()
+        df = table.to_pandas().sort_values('timestamp', ascending=False)
+        return df.iloc[0].to_dict()
+
+    def _fill_unchanged(self, player_tag, table, base=None):
+        """Oldest-first copy of a read with marker rows filled in from the full row before them"""
+        table = table.sort_by('timestamp')
+        if not table.column('unchanged')[0].as_py():
+            return fill_unchanged(table)
+
+        # A window that starts on a marker needs the full row from before it
+        if base is None:
+            base = self.full_row_before(player_tag, table.column('timestamp')[0].as_py(), table.column_names)
+            if base is None:
+                return table
+        return fill_unchanged(pa.concat_tables([base, table])).slice(1)
+
+    def full_row_before(self, player_tag, before, columns):
+        """The player's newest full (not unchanged) row at or before a time, as a one-row table, or None"""
+        base = self.backend.read_base(player_tag, before, columns)
+        if base.num_rows == 0:
+            # Retention dropped it; the hourly rollup before the marker holds the same values
+            base = self.rollups.tiers['hourly'].latest_before([player_tag], before)
+            if base.num_rows == 0:
+                return None
+            base = base.select([name for name in columns if name != 'unchanged'])
+            base = base.append_column('unchanged', pa.array([False] * base.num_rows))
+        return base.sort_by('timestamp').slice(base.num_rows - 1).select(columns)
 
     def get_all_tracked_players(self):
         """Get list of all tracked player tags"""
-        if not self.stats_file.exists():
-            return []
+        return self.registry.tags()
 
-        df = pd.read_parquet(self.stats_file)
-        return df['player_tag'].unique().tolist()
+    def list_tracked_players(self, sort='last_seen', descending=True, offset=0, limit=100):
+        """One page of tracked players with first/last seen, snapshot count and last name"""
+        return self.registry.list_players(sort=sort, descending=descending, offset=offset, limit=limit)
 
     def calculate_trends(self, player_tag, days=7):
         """Calculate stat trends over time"""
-        history = self.get_player_history(player_tag)
+        # Common windows come straight from the per-player summary
+        if days in SUMMARY_WINDOWS:
+            summary = self.summaries.get(player_tag)
+            if summary is not None:
+                return self.summaries.calculate_trends(summary, days)
 
-        if history.empty or len(history) < 2:
-            return None
-
-        # Filter to last N days
+        # Only read the window and the columns the diff needs: raw snapshots
+        # while retention keeps the whole window, rollups once it doesn't
         cutoff_date = datetime.now() - pd.Timedelta(days=days)
-        recent = history[history['timestamp'] >= cutoff_date].copy()
-
-        if len(recent) < 2:
+        horizon = self.rollups.horizon('raw')
+        resolution = 'raw' if horizon is None or cutoff_date >= horizon else None
+        recent = self.read_history(player_tag, since=cutoff_date, columns=TREND_COLUMNS, resolution=resolution)
+        if recent.num_rows == 0:
             return None
 
-        # Calculate changes
-        latest = recent.iloc[0]
-        oldest = recent.iloc[-1]
-
-        trends = {
-            'trophy_change': int(latest['trophies'] - oldest['trophies']),
-            'win_change': int(latest['wins'] - oldest['wins']),
-            'loss_change': int(latest['losses'] - oldest['losses']),
-            'three_crown_change': int(latest['three_crown_wins'] - oldest['three_crown_wins']),
-            'days_tracked': days,
-            'data_points': len(recent),
-            'win_rate': None
-        }
-
-        # Calculate win rate if we have battle data
-        total_battles = trends['win_change'] + trends['loss_change']
-        if total_battles > 0:
-            trends['win_rate'] = round((trends['win_change'] / total_battles) * 100, 1)
+        latest = recent.slice(recent.num_rows - 1).to_pylist()[0]
+        if 'snapshots' in recent.column_names:
+            # Rollup rows stand for several snapshots each, and the window
+            # starts at the first snapshot of its first period
+            data_points = pc.sum(recent.column('snapshots')).as_py()
+            oldest = period_starts(recent.slice(0, 1)).to_pylist()[0]
+        else:
+            data_points = recent.num_rows
+            oldest = recent.slice(0, 1).to_pylist()[0]
 
-        return trends
+        if data_points < 2:
+            return None
+        return build_trends(latest, oldest, days, data_points)
 
     def get_stats_dataframe(self, player_tag):
-        """Get full stats DataFrame for advanced analysis"""
+        """Get full stats DataFrame for advanced analysis (see iter_stats for long histories)"""
         return self.get_player_history(player_tag)
+
+    def iter_stats(self, player_tags=None, since=None, until=None, columns=None, resolution='raw',
+                   batch_rows=10000, as_dataframes=False):
+        """Yield history in timestamp order as record batches, or DataFrame chunks
+
+        player_tags is a tag or a list of tags (default: every player), and
+        rows have since <= timestamp < until. History is read a day at a
+        time, so memory use is bounded by the busiest day and batch_rows
+        rather than by how long players have been tracked.
+        """
+        if isinstance(player_tags, str):
+            player_tags = [player_tags]
+        for table in iter_export_tables(self, player_tags, since, until, columns, resolution):
+            # Days come in order; within one, rows are sorted by player
+            for batch in table.sort_by('timestamp').to_batches(max_chunksize=batch_rows):
+                yield batch.to_pandas() if as_dataframes else batch
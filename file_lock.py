@@ -0,0 +1,41 @@
+"""Advisory file locks and atomic file replacement for multi-process writers"""
+
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+
+@contextmanager
+def file_lock(path, shared=False, blocking=True):
+    """Hold an flock on path for the duration of the block
+
+    Locks belong to the open file, so they serialize threads in one process
+    as well as separate worker processes. With blocking=False a held lock
+    raises BlockingIOError instead of waiting.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        fcntl.flock(fd, flags)
+        yield fd
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def atomic_write_json(path, data, **dump_options):
+    """Write JSON to a private temp file and rename it over path"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, **dump_options)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
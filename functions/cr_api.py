@@ -1,29 +1,236 @@
 """Clash Royale API Client"""
 
+import hashlib
+import inspect
 import os
+import tempfile
+import threading
+import time
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from urllib.parse import quote
+from urllib3.util.retry import Retry
+from player_snapshot import PlayerSnapshot, loads
+from rate_limiter import RateLimited, TokenBucket
 
 # Load environment variables
 load_dotenv()
 
+# Connections kept alive per host, and (connect, read) timeouts in seconds
+POOL_SIZE = int(os.getenv('CR_API_POOL_SIZE', '10'))
+TIMEOUT = (float(os.getenv('CR_API_CONNECT_TIMEOUT', '3.05')), float(os.getenv('CR_API_READ_TIMEOUT', '10')))
+
+# Retries of 429/5xx responses and failed connections, with jittered
+# exponential backoff starting at RETRY_BACKOFF seconds
+RETRIES = int(os.getenv('CR_API_RETRIES', '3'))
+RETRY_BACKOFF = float(os.getenv('CR_API_RETRY_BACKOFF', '0.5'))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Requests per second each API key may make across every process on this
+# machine (0 = no limit), the burst allowed above it, and how long a call
+# queues for a token before failing (0 = fail fast)
+RATE_LIMIT = float(os.getenv('CR_API_RATE_LIMIT', '0'))
+RATE_BURST = float(os.getenv('CR_API_RATE_BURST', '0')) or None
+RATE_LIMIT_WAIT = float(os.getenv('CR_API_RATE_LIMIT_WAIT', '30'))
+RATE_LIMIT_DB = os.getenv('CR_API_RATE_LIMIT_DB', os.path.join(tempfile.gettempdir(), 'cr_api_quota.sqlite'))
+
+# Seconds a key that got a 403 (revoked, or not allowed from this IP) is left out of rotation
+KEY_BENCH_SECONDS = float(os.getenv('CR_API_KEY_BENCH_SECONDS', '300'))
+
+# Longest a single Retry-After wait may last, so a throttled call can't stall a worker
+MAX_RETRY_AFTER = 10
+
+
+# backoff_jitter and backoff_max only exist from urllib3 2.0 on; 1.26, which
+# the Firebase dependencies can resolve to, backs off without them
+_RETRY_OPTIONS = inspect.signature(Retry.__init__).parameters
+
+
+class _Retry(Retry):
+    """Retry that honors Retry-After, capped at MAX_RETRY_AFTER seconds"""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, MAX_RETRY_AFTER)
+
+
+def create_session(pool_size=POOL_SIZE, retries=RETRIES, backoff=RETRY_BACKOFF):
+    """A requests session with a keep-alive connection pool and retries"""
+    options = {}
+    if 'backoff_jitter' in _RETRY_OPTIONS:
+        options['backoff_jitter'] = backoff
+    if 'backoff_max' in _RETRY_OPTIONS:
+        options['backoff_max'] = MAX_RETRY_AFTER
+    retry = _Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=['GET'],
+        respect_retry_after_header=True,
+        # Hand the last 429/5xx back so callers report it like any other error
+        raise_on_status=False,
+        **options,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def shared_session():
+    """The process-wide session every client shares by default"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def api_keys_from_env():
+    """API keys from CLASH_ROYALE_API_KEYS (comma-separated), else CLASH_ROYALE_API_KEY"""
+    keys = [key.strip() for key in os.getenv('CLASH_ROYALE_API_KEYS', '').split(',') if key.strip()]
+    if not keys and os.getenv('CLASH_ROYALE_API_KEY'):
+        keys = [os.getenv('CLASH_ROYALE_API_KEY')]
+    return keys
+
+
+class _ApiKey:
+    """One key of a pool: its request headers, request budget and health"""
+
+    def __init__(self, key, bucket):
+        self.key = key
+        self.headers = {
+            'Authorization': f'Bearer {key}',
+            'Accept': 'application/json'
+        }
+        self.bucket = bucket
+        self.benched_until = 0
+        self.requests = 0
+        self.forbidden = 0
+
+
+class KeyPool:
+    """API keys handed out round-robin, each with its own request budget and health
+
+    Every key draws from its own token bucket of `rate` requests per second,
+    shared by every process on the machine (no budget with rate 0), so
+    throughput grows with the number of keys. acquire() hands out the next
+    healthy key with a token to spare, or waits for the first one to refill.
+    A key that gets a 403 is benched for bench_seconds.
+    """
+
+    def __init__(self, keys, rate=RATE_LIMIT, burst=RATE_BURST, db_path=RATE_LIMIT_DB,
+                 bench_seconds=KEY_BENCH_SECONDS):
+        self.keys = []
+        for key in keys:
+            # Buckets are named by a hash so keys aren't written to disk
+            name = 'key-' + hashlib.sha256(key.encode()).hexdigest()[:16]
+            self.keys.append(_ApiKey(key, TokenBucket(db_path, rate, burst, name) if rate > 0 else None))
+        self.bench_seconds = bench_seconds
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _rotation(self):
+        """Healthy keys, starting one further along on every call"""
+        with self._lock:
+            start = self._next
+            self._next = (start + 1) % len(self.keys)
+        now = time.monotonic()
+        return [key for key in self.keys[start:] + self.keys[:start] if key.benched_until <= now]
+
+    def acquire(self, timeout=None):
+        """The key to send the next request with
+
+        Waits up to timeout seconds (forever with None, not at all with 0)
+        when every key's budget is spent. Raises RateLimited when no key
+        frees up in time or every key is benched.
+        """
+        started = time.monotonic()
+        while True:
+            waited = time.monotonic() - started
+            keys = self._rotation()
+            if not keys:
+                raise RateLimited("Every API key was refused (403) recently and is benched")
+            waits = []
+            for key in keys:
+                wait = key.bucket.try_acquire(waited) if key.bucket else 0
+                if not wait:
+                    with self._lock:
+                        key.requests += 1
+                    return key
+                waits.append((wait, key))
+            wait, soonest = min(waits, key=lambda item: item[0])
+            if timeout is not None and waited + wait > timeout:
+                soonest.bucket.reject()
+                raise RateLimited(f"Rate limit of {soonest.bucket.rate:g}/s reached on all {len(keys)} API keys; "
+                                  f"next request allowed in {wait:.2f}s")
+            # Another process may take the token first; then this waits again
+            time.sleep(wait)
+
+    def bench(self, key):
+        """Take a key out of rotation for bench_seconds"""
+        with self._lock:
+            key.forbidden += 1
+            key.benched_until = time.monotonic() + self.bench_seconds
+        print(f"API key ...{key.key[-4:]} was refused (403); benched for {self.bench_seconds:g}s")
+
+    def stats(self):
+        """Requests, 403s, health and budget metrics of each key"""
+        now = time.monotonic()
+        return [{
+            'key': f'...{key.key[-4:]}',
+            'healthy': key.benched_until <= now,
+            'benched_for': round(max(key.benched_until - now, 0), 1),
+            'requests': key.requests,
+            'forbidden': key.forbidden,
+            **(key.bucket.stats() if key.bucket else {}),
+        } for key in self.keys]
+
+
+_pools = {}
+
+
+def shared_key_pool(keys, rate=RATE_LIMIT):
+    """The process-wide pool for a set of keys, so every client sees the same key health"""
+    pool_key = (tuple(keys), rate)
+    with _session_lock:
+        if pool_key not in _pools:
+            _pools[pool_key] = KeyPool(keys, rate)
+        return _pools[pool_key]
+
+
+def normalize_tag(tag):
+    """Canonical form of a player tag: upper case with a leading #"""
+    return '#' + tag.strip().lstrip('#').upper()
+
+
 class ClashRoyaleAPI:
     """Client for Clash Royale API"""
 
     # Use proxy VM with static IP instead of direct API calls
     # This allows us to whitelist a single static IP in the Clash Royale API
-    BASE_URL = "http://34.123.171.42:8080/v1"
+    BASE_URL = os.getenv('CR_API_BASE_URL', "http://34.123.171.42:8080/v1")
 
-    def __init__(self, api_key=None):
-        self.api_key = api_key or os.getenv('CLASH_ROYALE_API_KEY')
-        if not self.api_key:
-            raise ValueError("API key is required. Set CLASH_ROYALE_API_KEY in .env file")
+    def __init__(self, api_key=None, session=None, timeout=TIMEOUT, rate_limit=RATE_LIMIT, limit_wait=RATE_LIMIT_WAIT,
+                 api_keys=None):
+        keys = api_keys or ([api_key] if api_key else api_keys_from_env())
+        if not keys:
+            raise ValueError("API key is required. Set CLASH_ROYALE_API_KEY (or CLASH_ROYALE_API_KEYS) in .env file")
 
-        self.headers = {
-            'Authorization': f'Bearer {self.api_key}',
-            'Accept': 'application/json'
-        }
+        self.api_key = keys[0]
+        # Requests go out on whichever key has budget to spare; calls wait up to
+        # limit_wait seconds for one (None = as long as it takes)
+        self.keys = shared_key_pool(keys, rate_limit)
+        self.limit_wait = limit_wait
+        self.session = session or shared_session()
+        self.timeout = timeout
 
     def _encode_tag(self, tag):
         """Encode player tag for URL (handle # symbol)"""
@@ -31,18 +238,44 @@ class ClashRoyaleAPI:
             tag = f'#{tag}'
         return quote(tag)
 
-    def get_player(self, player_tag):
+    def _get(self, url, etag=None):
+        """GET a URL on the pooled session, retrying throttled and failed requests
+
+        With an etag, the request is conditional and may come back 304 Not
+        Modified. Raises RateLimited when no key has budget in time.
+        """
+        for _ in range(len(self.keys.keys)):
+            key = self.keys.acquire(self.limit_wait)
+            headers = key.headers
+            if etag:
+                headers = {**headers, 'If-None-Match': etag}
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code != 403:
+                break
+            # Revoked or not allowed from this IP; try the request on another key
+            self.keys.bench(key)
+        return response
+
+    def _ok(self, response, decode=loads):
+        """Result of a successful response; a 304 has no data, only not_modified"""
+        result = {'success': True}
+        if response.status_code == 304:
+            result['not_modified'] = True
+        else:
+            result['data'] = decode(response.content)
+        if response.headers.get('ETag'):
+            result['etag'] = response.headers['ETag']
+        return result
+
+    def get_player(self, player_tag, etag=None, decode=loads):
         """Get player information by tag"""
         encoded_tag = self._encode_tag(player_tag)
         url = f"{self.BASE_URL}/players/{encoded_tag}"
 
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self._get(url, etag)
             response.raise_for_status()
-            return {
-                'success': True,
-                'data': response.json()
-            }
+            return self._ok(response, decode)
         except requests.exceptions.HTTPError as e:
             error_detail = ''
             try:
@@ -73,36 +306,39 @@ class ClashRoyaleAPI:
                 'error': str(e)
             }
 
-    def get_battlelog(self, player_tag):
+    def get_player_snapshot(self, player_tag, etag=None):
+        """Get player information by tag as a compact PlayerSnapshot
+
+        The response is decoded once, keeping only the fields stats tracking
+        reads; cards, badges and the other large sections are dropped and
+        decoded again from the raw JSON if they're read.
+        """
+        return self.get_player(player_tag, etag, decode=PlayerSnapshot)
+
+    def get_battlelog(self, player_tag, etag=None):
         """Get player's recent battles"""
         encoded_tag = self._encode_tag(player_tag)
         url = f"{self.BASE_URL}/players/{encoded_tag}/battlelog"
 
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self._get(url, etag)
             response.raise_for_status()
-            return {
-                'success': True,
-                'data': response.json()
-            }
+            return self._ok(response)
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
 
-    def get_upcoming_chests(self, player_tag):
+    def get_upcoming_chests(self, player_tag, etag=None):
         """Get player's upcoming chests"""
         encoded_tag = self._encode_tag(player_tag)
         url = f"{self.BASE_URL}/players/{encoded_tag}/upcomingchests"
 
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self._get(url, etag)
             response.raise_for_status()
-            return {
-                'success': True,
-                'data': response.json()
-            }
+            return self._ok(response)
         except Exception as e:
             return {
                 'success': False,
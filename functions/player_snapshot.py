@@ -0,0 +1,87 @@
+"""Compact, field-projected decoding of Clash Royale player responses"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fastest JSON decoder available; both accept bytes
+loads = orjson.loads if orjson else json.loads
+
+# Player fields kept on every snapshot, as the API names them. Everything
+# else (badges, achievements, cards, decks, ...) is dropped after decoding
+# and only decoded again if it's read.
+PLAYER_FIELDS = (
+    'tag', 'name', 'expLevel', 'expPoints', 'totalExpPoints', 'starPoints',
+    'trophies', 'bestTrophies', 'wins', 'losses', 'battleCount', 'threeCrownWins',
+    'challengeCardsWon', 'challengeMaxWins', 'tournamentCardsWon', 'tournamentBattleCount',
+    'role', 'donations', 'donationsReceived', 'totalDonations', 'warDayWins', 'clanCardsCollected',
+    'clan', 'arena',
+)
+
+
+class PlayerSnapshot:
+    """A player response reduced to PLAYER_FIELDS plus its raw JSON
+
+    The response is decoded once when the snapshot is built, and only the
+    projected fields are kept, in slots: a snapshot holds a few hundred
+    bytes of objects next to one immutable bytes buffer instead of
+    thousands of nested dicts. Reads work like the response dict:
+    snapshot.get('wins'), snapshot['trophies'], or attributes. Any other
+    field, such as cards, decodes the raw JSON a second time on first
+    access and is served from that afterwards. card_count is kept so
+    totals need no second decode.
+    """
+
+    __slots__ = (*PLAYER_FIELDS, 'card_count', '_raw', '_full')
+
+    def __init__(self, raw, data=None):
+        if data is None:
+            data = loads(raw)
+        for name in PLAYER_FIELDS:
+            setattr(self, name, data.get(name))
+        self.card_count = len(data.get('cards', ()))
+        self._raw = raw
+        self._full = None
+
+    def to_dict(self):
+        """The full response as nested dicts, decoded on the first call"""
+        if self._full is None:
+            self._full = loads(self._raw)
+        return self._full
+
+    def get(self, key, default=None):
+        if key in PLAYER_FIELDS:
+            value = getattr(self, key)
+            return default if value is None else value
+        return self.to_dict().get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getattr__(self, name):
+        # Only reached for names that aren't slots: the lazily decoded sections
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __repr__(self):
+        return f"PlayerSnapshot({self.tag!r}, {self.name!r})"
+
+
+def card_count(player_data):
+    """Cards a player owns, from a snapshot or a response dict"""
+    if isinstance(player_data, PlayerSnapshot):
+        return player_data.card_count
+    return len(player_data.get('cards', []))
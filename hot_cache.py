@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Memory-mapped Arrow IPC cache of the last few days of stats history"""
+
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from file_lock import file_lock
+from parquet_backend import sort_by_player
+from stats_backends import STATS_SCHEMA, EPOCH, fill_unchanged
+from stats_retention import unique_rows
+
+# Days of snapshots kept in the hot cache
+HOT_CACHE_DAYS = 7
+
+# Snapshots stamped this recently may still be on their way to storage, so the
+# cache stops short of them and reads take them from the backend instead
+HOT_CACHE_LAG = timedelta(seconds=30)
+
+# Every STATS_SCHEMA column; marker rows are stored filled in
+HOT_SCHEMA = pa.schema([field for field in STATS_SCHEMA if field.name != 'unchanged'])
+
+
+def _micros(timestamp):
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+class _HotFile:
+    """One mapped version of the cache file and its per-player row index"""
+
+    def __init__(self, path, key):
+        self.key = key
+        # Uncompressed IPC buffers are used in place: no copy, no decode, and
+        # every process mapping the file shares the same page cache
+        self.table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+        metadata = self.table.schema.metadata
+        self.since = datetime.fromisoformat(metadata[b'since'].decode())
+        self.until = datetime.fromisoformat(metadata[b'until'].decode())
+
+        self.index = {}
+        self.timestamps = np.empty(0, dtype=np.int64)
+        if self.table.num_rows:
+            # Rows are grouped by player, so each tag is one contiguous run
+            tags = self.table.column('player_tag').chunk(0)
+            indices = tags.indices.to_numpy()
+            bounds = np.flatnonzero(indices[1:] != indices[:-1]) + 1
+            starts = np.concatenate([[0], bounds])
+            stops = np.concatenate([bounds, [len(indices)]])
+            dictionary = tags.dictionary.to_pylist()
+            self.index = {dictionary[indices[start]]: (start, stop) for start, stop in zip(starts, stops)}
+            self.timestamps = self.table.column('timestamp').chunk(0).to_numpy().view(np.int64)
+
+
+class HotStatsCache:
+    """The last `days` days of snapshots in one Arrow IPC file every worker memory-maps
+
+    The file holds every player's rows sorted by (player_tag, timestamp) with
+    unchanged markers already filled in, so a history read is a zero-copy
+    slice. refresh() rebuilds it from the storage backend and swaps it in
+    atomically; readers pick up the new file on their next read.
+    """
+
+    def __init__(self, path, days=HOT_CACHE_DAYS):
+        self.path = Path(path)
+        self.days = days
+        self._lock = threading.Lock()
+        self._hot = None
+
+    def _open(self):
+        """The current cache file, remapped if a refresh replaced it"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns)
+        hot = self._hot
+        if hot is None or hot.key != key:
+            with self._lock:
+                hot = self._hot
+                if hot is None or hot.key != key:
+                    try:
+                        hot = self._hot = _HotFile(self.path, key)
+                    except FileNotFoundError:
+                        return None
+        return hot
+
+    def read(self, player_tag, since=None, until=None, columns=None, limit=None):
+        """A player's cached rows with since <= timestamp <= until, oldest first
+
+        Returns (rows, cached_until), or None when the query reaches back
+        before the cache. With no since, a limit the cache can fill is
+        enough. Snapshots at or after cached_until aren't cached.
+        """
+        hot = self._open()
+        if hot is None:
+            return None
+
+        start, stop = hot.index.get(player_tag, (0, 0))
+        timestamps = hot.timestamps[start:stop]
+        if until is not None:
+            stop = start + int(np.searchsorted(timestamps, _micros(until), side='right'))
+        if since is not None and since >= hot.since:
+            start += int(np.searchsorted(timestamps, _micros(since), side='left'))
+        elif limit and stop - start >= limit:
+            start = stop - limit
+        else:
+            return None
+
+        names = [name for name in (columns or HOT_SCHEMA.names) if name != 'unchanged']
+        if 'timestamp' not in names:
+            names.append('timestamp')
+        return hot.table.slice(start, max(stop - start, 0)).select(names), hot.until
+
+    def last_row(self, player_tag, columns):
+        """The player's newest cached row as a full (not unchanged) row with the given columns, or None"""
+        hot = self._open()
+        if hot is None or player_tag not in hot.index:
+            return None
+        stop = hot.index[player_tag][1]
+        row = hot.table.slice(stop - 1, 1).select([name for name in columns if name != 'unchanged'])
+        row = row.append_column('unchanged', pa.array([False]))
+        return row.select(columns)
+
+    def refresh(self, store, now=None, max_age=None):
+        """Rebuild the cache file from the store's backend
+
+        With max_age, skip the rebuild when another worker refreshed the
+        file more recently than that many seconds ago. Returns the number of
+        cached rows, or None when skipped.
+        """
+        # Workers refreshing together would each scan the same history
+        with file_lock(self.path.with_name(f".{self.path.name}.lock")):
+            if max_age is not None and self.path.exists() and time.time() - self.path.stat().st_mtime < max_age:
+                return None
+
+            until = (now or datetime.now()) - HOT_CACHE_LAG
+            since = until - timedelta(days=self.days)
+            table = self._build(store, since, until)
+
+            table = table.replace_schema_metadata({'since': since.isoformat(), 'until': until.isoformat()})
+            tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+            with pa.ipc.new_file(str(tmp_path), table.schema) as writer:
+                writer.write_table(table)
+            # Readers still mapping the old file keep it until they remap
+            os.replace(tmp_path, self.path)
+            return table.num_rows
+
+    def _build(self, store, since, until):
+        """Every player's rows in [since, until), filled in and sorted by (player_tag, timestamp)"""
+        table = unique_rows(sort_by_player(store.backend.read_range(since, until)))
+
+        # A player whose window starts on a marker needs the full row from before it
+        bases = []
+        if table.num_rows:
+            tags = table.column('player_tag').cast(pa.string()).to_numpy(zero_copy_only=False)
+            unchanged = table.column('unchanged').fill_null(False).to_numpy(zero_copy_only=False)
+            firsts = np.flatnonzero(np.concatenate([[True], tags[1:] != tags[:-1]]))
+            firsts = firsts[unchanged[firsts]]
+            for first, timestamp in zip(firsts, table.column('timestamp').take(firsts).to_pylist()):
+                base = store.full_row_before(tags[first], timestamp, table.column_names)
+                if base is not None:
+                    bases.append(base)
+        if bases:
+            table = sort_by_player(pa.concat_tables([table, *bases]))
+        table = fill_unchanged(table)
+        if bases:
+            table = table.filter(pc.greater_equal(table.column('timestamp'), pa.scalar(since, pa.timestamp('us'))))
+
+        # One batch with one dictionary per column, so the file maps as a single chunk
+        table = table.select(HOT_SCHEMA.names).combine_chunks()
+        for index, field in enumerate(HOT_SCHEMA):
+            if pa.types.is_dictionary(field.type):
+                column = table.column(index).cast(pa.string()).combine_chunks().dictionary_encode()
+                table = table.set_column(index, field, column.cast(field.type))
+        return table
+
+
+class HotCacheScheduler:
+    """Refresh the hot cache periodically on a background thread"""
+
+    def __init__(self, store, interval=60):
+        self.store = store
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stats-hot-cache', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ask the background thread to exit"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        # Build right away so a fresh worker maps a current cache
+        while True:
+            try:
+                # Workers share the file; only one of them rebuilds it per interval
+                self.store.hot_cache.refresh(self.store, max_age=self.interval / 2)
+            except Exception as e:
+                print(f"Error refreshing hot cache: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-dir', default='data', help='Stats data directory')
+    parser.add_argument('--backend', default='parquet', help='Stats storage backend')
+    parser.add_argument('--days', type=int, default=HOT_CACHE_DAYS, help='Days of snapshots to cache')
+    args = parser.parse_args()
+
+    from data_store import PlayerStatsStore
+    store = PlayerStatsStore(args.data_dir, backend=args.backend, hot_cache_days=args.days)
+    started = time.monotonic()
+    rows = store.hot_cache.refresh(store)
+    print(f"Cached {rows} snapshots from the last {args.days} days in {time.monotonic() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,14 @@
 import json
 import os
 from pathlib import Path
+from file_lock import file_lock, atomic_write_json
 
 KISS_DATA_FILE = 'card_kisses.json'
 
+def _lock_path():
+    """Lock file guarding read-modify-write of the kiss data"""
+    return f"{KISS_DATA_FILE}.lock"
+
 def load_kisses():
     """Load kiss data from JSON file"""
     if os.path.exists(KISS_DATA_FILE):
@@ -14,16 +19,17 @@ def load_kisses():
 
 def save_kisses(kisses):
     """Save kiss data to JSON file"""
-    with open(KISS_DATA_FILE, 'w') as f:
-        json.dump(kisses, f, indent=2)
+    # Rename into place so readers never see a half-written file
+    atomic_write_json(KISS_DATA_FILE, kisses, indent=2)
 
 def add_kiss(card_name):
     """Add a kiss to a card"""
-    kisses = load_kisses()
-    if card_name not in kisses:
-        kisses[card_name] = 0
-    kisses[card_name] += 1
-    save_kisses(kisses)
+    with file_lock(_lock_path()):
+        kisses = load_kisses()
+        if card_name not in kisses:
+            kisses[card_name] = 0
+        kisses[card_name] += 1
+        save_kisses(kisses)
     return kisses[card_name]
 
 def get_leaderboard(limit=None):
@@ -41,8 +47,9 @@ def get_card_kisses(card_name):
 
 def remove_kiss(card_name):
     """Remove a kiss from a card (slap)"""
-    kisses = load_kisses()
-    if card_name in kisses and kisses[card_name] > 0:
-        kisses[card_name] -= 1
-        save_kisses(kisses)
+    with file_lock(_lock_path()):
+        kisses = load_kisses()
+        if card_name in kisses and kisses[card_name] > 0:
+            kisses[card_name] -= 1
+            save_kisses(kisses)
     return kisses.get(card_name, 0)
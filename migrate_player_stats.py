@@ -4,6 +4,7 @@ import pandas as pd
 import firebase_admin
 from firebase_admin import credentials, firestore
 from datetime import datetime, timezone
+from data_store import PlayerStatsStore
 
 # Initialize Firebase Admin (if not already initialized)
 try:
@@ -16,8 +17,10 @@ except ValueError:
 
 db = firestore.client()
 
-# Load player stats from Parquet
-df = pd.read_parquet('data/player_stats.parquet')
+# Load player stats through the stats store, which fills unchanged marker
+# rows in from the snapshot before them
+chunks = list(PlayerStatsStore('data').iter_stats(as_dataframes=True))
+df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
 
 print(f"Found {len(df)} player stat records to migrate")
 print(f"Columns: {list(df.columns)}")
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""Offline stand-in for the Clash Royale API serving deterministic synthetic players
+
+Any well-formed tag is a player whose stats follow from the tag: the same
+tag gets the same name, cards and history on every run, and players play
+a few battles an hour, so snapshots and battlelogs change over time the
+way real ones do. Responses are shaped and sized like the real API's
+(see sample_player_response.json). Latency, server errors and 429s can be
+injected to exercise retries, rate limiting and caching.
+
+Point the app at it with CR_API_BASE_URL=http://127.0.0.1:8000/v1.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from flask import Flask, Response, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+TEMPLATE = json.loads(Path(__file__).with_name('sample_player_response.json').read_text())
+
+# Characters player and clan tags are made of
+TAG_CHARS = '0289PYLQGRJCUV'
+
+# Synthetic history starts here; stats advance with every battle played since
+ORIGIN = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+BATTLELOG_SIZE = 25
+CLAN_COUNT = 5000
+CLAN_SIZE = 50
+
+CHEST_CYCLE = ['Silver Chest'] * 5 + ['Golden Chest'] * 2 + ['Magical Chest', 'Giant Chest']
+
+
+def _dumps(data):
+    return orjson.dumps(data) if orjson else json.dumps(data, separators=(',', ':')).encode()
+
+
+def _seed(*parts):
+    return zlib.crc32('/'.join(map(str, parts)).encode())
+
+
+def _tag(rng):
+    return '#' + ''.join(rng.choice(TAG_CHARS) for _ in range(rng.randint(8, 9)))
+
+
+def player_tags(count, seed=0):
+    """The first count tags of a deterministic population of players"""
+    rng = random.Random(seed)
+    return [_tag(rng) for _ in range(count)]
+
+
+def clan_tag(index):
+    return _tag(random.Random(_seed('clan', index)))
+
+
+@lru_cache(maxsize=1)
+def _clan_indexes():
+    return {clan_tag(index): index for index in range(CLAN_COUNT)}
+
+
+def valid_tag(tag):
+    return tag.startswith('#') and 3 <= len(tag) <= 12 and all(char in TAG_CHARS for char in tag[1:])
+
+
+def _battle_time(moment):
+    return moment.strftime('%Y%m%dT%H%M%S.000Z')
+
+
+@lru_cache(maxsize=100000)
+def _profile(tag):
+    return _Profile(tag)
+
+
+class _Profile:
+    """The fixed traits of one synthetic player, derived from their tag"""
+
+    def __init__(self, tag):
+        rng = random.Random(_seed('player', tag))
+        self.tag = tag
+        self.name = f"{rng.choice(['Hog', 'Royal', 'Pekka', 'Miner', 'Golem', 'Goblin', 'Witch'])}{rng.choice(['Rider', 'Slayer', 'King', 'Master', 'Gang'])}{rng.randint(1, 999)}"
+        self.exp_level = rng.randint(10, 70)
+        self.base_trophies = rng.randint(1000, 9000)
+        self.base_battles = rng.randint(100, 20000)
+        self.win_rate = rng.uniform(0.42, 0.6)
+        self.three_crown_rate = rng.uniform(0.1, 0.35)
+        # Battles per hour while playing
+        self.battles_per_hour = rng.uniform(0.2, 4.0)
+        self.clan_index = rng.randrange(CLAN_COUNT) if rng.random() < 0.85 else None
+        self.role = rng.choice(['member', 'member', 'member', 'elder', 'coLeader', 'leader'])
+        self.card_levels = [rng.randint(max(card['maxLevel'] - 8, 1), card['maxLevel']) for card in TEMPLATE['cards']]
+        self.deck = rng.sample(range(len(TEMPLATE['cards'])), 8)
+
+    def battles_played(self, now):
+        """Battles played since ORIGIN up to now"""
+        hours = max((now - ORIGIN) / timedelta(hours=1), 0)
+        return int(hours * self.battles_per_hour)
+
+    def battle(self, number):
+        """The outcome of this player's numbered battle: (won, crowns, opponent crowns)"""
+        rng = random.Random(_seed('battle', self.tag, number))
+        won = rng.random() < self.win_rate
+        crowns = 3 if won and rng.random() < self.three_crown_rate else rng.randint(1, 2) if won else rng.randint(0, 2)
+        opponent_crowns = rng.randint(0, crowns - 1) if won else rng.randint(max(crowns, 1), 3)
+        return won, crowns, opponent_crowns
+
+    def battle_time(self, number):
+        return ORIGIN + timedelta(hours=number / self.battles_per_hour)
+
+
+class MockClashRoyaleAPI:
+    """Synthetic player data plus the latency and failures to serve it with
+
+    error_rate and throttle_rate are the fractions of requests answered
+    with a 503 and a 429 (with Retry-After); quota caps each API key's
+    requests per second, answering the excess with 429s like the real API,
+    and keys in forbidden_keys get 403s. requests counts the requests
+    served per endpoint.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, quota=0, seed=None,
+                 forbidden_keys=()):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.quota = quota
+        self.forbidden_keys = set(forbidden_keys)
+        self.requests = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def profile(self, tag):
+        return _profile(tag)
+
+    def player(self, tag, now=None):
+        """The player's response as of now"""
+        profile = self.profile(tag)
+        battles = profile.battles_played(now or datetime.now(timezone.utc))
+        outcomes = [profile.battle(number) for number in range(max(battles - 200, 0), battles)]
+        recent = sum(1 if won else -1 for won, _, _ in outcomes)
+        wins = int((profile.base_battles + battles) * profile.win_rate)
+        trophies = max(profile.base_trophies + 30 * recent, 0)
+
+        cards = []
+        for card, level in zip(TEMPLATE['cards'], profile.card_levels):
+            cards.append({**card, 'level': level, 'count': (battles + card['id']) % 500})
+        data = {
+            **TEMPLATE,
+            'tag': tag,
+            'name': profile.name,
+            'expLevel': profile.exp_level,
+            'trophies': trophies,
+            'bestTrophies': max(trophies, profile.base_trophies + 600),
+            'wins': wins,
+            'losses': profile.base_battles + battles - wins,
+            'battleCount': profile.base_battles + battles,
+            'threeCrownWins': int(wins * profile.three_crown_rate),
+            'role': profile.role,
+            'donations': battles % 300,
+            'donationsReceived': battles % 240,
+            'totalDonations': profile.base_battles * 3 + battles,
+            'cards': cards,
+            'currentDeck': [cards[index] for index in profile.deck],
+        }
+        if profile.clan_index is None:
+            data.pop('clan', None)
+            data.pop('role', None)
+        else:
+            data['clan'] = {'tag': clan_tag(profile.clan_index), 'name': f"Clan {profile.clan_index}", 'badgeId': 16000000 + profile.clan_index % 180}
+        return data
+
+    def _member(self, tag):
+        return {'tag': tag, 'name': self.profile(tag).name, 'role': self.profile(tag).role, 'expLevel': self.profile(tag).exp_level}
+
+    def _participant(self, tag, name, trophies, crowns, trophy_change, deck):
+        return {
+            'tag': tag,
+            'name': name,
+            'startingTrophies': trophies,
+            'trophyChange': trophy_change,
+            'crowns': crowns,
+            'kingTowerHitPoints': 0 if crowns == 3 else 4824,
+            'princessTowersHitPoints': [3052] * (2 - min(crowns, 2)),
+            'cards': [{key: card[key] for key in ('name', 'id', 'level', 'maxLevel', 'rarity', 'elixirCost', 'iconUrls') if key in card} for card in deck],
+            'supportCards': TEMPLATE['supportCards'][:1],
+            'elixirLeaked': round((crowns * 1.7) % 5, 2),
+        }
+
+    def battlelog(self, tag, now=None):
+        """The player's last BATTLELOG_SIZE battles, newest first"""
+        profile = self.profile(tag)
+        battles = profile.battles_played(now or datetime.now(timezone.utc))
+        log = []
+        for number in range(battles - 1, max(battles - BATTLELOG_SIZE, 0) - 1, -1):
+            won, crowns, opponent_crowns = profile.battle(number)
+            rng = random.Random(_seed('opponent', tag, number))
+            opponent = self.profile(_tag(rng))
+            change = rng.randint(25, 35) * (1 if won else -1)
+            trophies = profile.base_trophies
+            deck = [TEMPLATE['cards'][index] for index in profile.deck]
+            opponent_deck = [TEMPLATE['cards'][index] for index in opponent.deck]
+            log.append({
+                'type': 'PvP',
+                'battleTime': _battle_time(profile.battle_time(number)),
+                'isLadderTournament': False,
+                'arena': TEMPLATE['arena'],
+                'gameMode': {'id': 72000006, 'name': 'Ladder'},
+                'deckSelection': 'collection',
+                'team': [self._participant(tag, profile.name, trophies, crowns, change, deck)],
+                'opponent': [self._participant(opponent.tag, opponent.name, trophies + rng.randint(-100, 100),
+                                               opponent_crowns, -change, opponent_deck)],
+                'isHostedMatch': False,
+                'leagueNumber': 1,
+            })
+        return log
+
+    def upcoming_chests(self, tag, now=None):
+        profile = self.profile(tag)
+        start = profile.battles_played(now or datetime.now(timezone.utc)) // 3
+        return {'items': [{'index': index, 'name': CHEST_CYCLE[(start + index) % len(CHEST_CYCLE)]} for index in range(9)]}
+
+    def clan(self, tag):
+        index = _clan_indexes().get(tag)
+        if index is None:
+            return None
+        members = self.clan_members(tag)
+        return {
+            'tag': tag,
+            'name': f"Clan {index}",
+            'type': 'open',
+            'badgeId': 16000000 + index % 180,
+            'clanScore': sum(self.profile(member['tag']).base_trophies for member in members) // len(members),
+            'members': len(members),
+            'memberList': members,
+        }
+
+    def clan_members(self, tag):
+        rng = random.Random(_seed('members', tag))
+        return [self._member(_tag(rng)) for _ in range(CLAN_SIZE)]
+
+    def record(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def fault(self, api_key):
+        """An injected (status, headers) failure for the next request with a key, or None"""
+        if api_key in self.forbidden_keys:
+            return 403, {}
+        with self._lock:
+            if self.quota:
+                second = int(time.time())
+                window, used = self._windows.get(api_key, (0, 0))
+                used = used + 1 if window == second else 1
+                self._windows[api_key] = (second, used)
+                if used > self.quota:
+                    return 429, {'Retry-After': '1'}
+            roll = self._rng.random()
+        if roll < self.throttle_rate:
+            return 429, {'Retry-After': '1'}
+        if roll < self.throttle_rate + self.error_rate:
+            return 503, {}
+        return None
+
+    def delay(self):
+        with self._lock:
+            delay = self.latency + self._rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _error(status, reason, message, headers=None):
+    return Response(_dumps({'reason': reason, 'message': message}), status=status,
+                    headers=headers, mimetype='application/json')
+
+
+def create_app(mock):
+    """Flask app serving the API's /v1 player and clan endpoints from a MockClashRoyaleAPI"""
+    app = Flask(__name__)
+
+    def respond(endpoint, tag, build):
+        mock.record(endpoint)
+        mock.delay()
+        fault = mock.fault(request.headers.get('Authorization', '').removeprefix('Bearer '))
+        if fault:
+            status, headers = fault
+            if status == 403:
+                return _error(403, 'accessDenied', 'Invalid authorization: API key does not allow access from IP 127.0.0.1')
+            if status == 429:
+                return _error(429, 'requestThrottled', 'Request was throttled, because amount of requests was above the threshold defined for the used API token.', headers)
+            return _error(status, 'serviceUnavailable', 'Service is temporarily unavailable because of maintenance.', headers)
+        tag = tag.upper()
+        if not valid_tag(tag):
+            return _error(404, 'notFound', 'Requested resource was not found.')
+        data = build(tag)
+        if data is None:
+            return _error(404, 'notFound', 'Requested resource was not found.')
+
+        body = _dumps(data)
+        etag = f'"{zlib.crc32(body):08x}"'
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=304, headers={'ETag': etag})
+        return Response(body, mimetype='application/json', headers={'ETag': etag, 'Cache-Control': 'max-age=60'})
+
+    @app.route('/v1/players/<path:tag>')
+    def player(tag):
+        if tag.endswith('/battlelog'):
+            return respond('battlelog', tag[:-len('/battlelog')], mock.battlelog)
+        if tag.endswith('/upcomingchests'):
+            return respond('upcomingchests', tag[:-len('/upcomingchests')], mock.upcoming_chests)
+        return respond('player', tag, mock.player)
+
+    @app.route('/v1/clans/<path:tag>')
+    def clan(tag):
+        if tag.endswith('/members'):
+            return respond('clan_members', tag[:-len('/members')], lambda tag: {'items': mock.clan_members(tag)})
+        return respond('clan', tag, mock.clan)
+
+    return app
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """Skip the per-request access log, which would cost more than the responses under load"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def _make_server(mock, host, port):
+    return make_server(host, port, create_app(mock), threaded=True, request_handler=_QuietRequestHandler)
+
+
+def start_server(mock, host='127.0.0.1', port=0):
+    """Serve a MockClashRoyaleAPI on a background thread; returns the server and its /v1 base URL"""
+    server = _make_server(mock, host, port)
+    threading.Thread(target=server.serve_forever, name='mock-cr-api', daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random +/- seconds around the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with a 429')
+    parser.add_argument('--quota', type=int, default=0, help='Requests per second per API key before answering 429 (0 = unlimited)')
+    parser.add_argument('--forbidden-keys', default='', help='Comma-separated API keys to answer with 403')
+    parser.add_argument('--list-tags', type=int, metavar='N', help='Print N player tags of the synthetic population and exit')
+    args = parser.parse_args()
+
+    if args.list_tags:
+        print('\n'.join(player_tags(args.list_tags)))
+        return
+
+    mock = MockClashRoyaleAPI(args.latency, args.jitter, args.error_rate, args.throttle_rate, args.quota,
+                              forbidden_keys=[key for key in args.forbidden_keys.split(',') if key])
+    server = _make_server(mock, args.host, args.port)
+    print(f"Mock Clash Royale API on http://{args.host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Served {sum(mock.requests.values())} requests: {dict(mock.requests)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""Player stats in a Hive-partitioned, append-only Parquet dataset"""
+
+import atexit
+import json
+import os
+import shutil
+import uuid
+import zlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from datetime import datetime, timedelta
+from pathlib import Path
+from file_lock import file_lock, atomic_write_json
+from stats_backends import StatsBackend, STATS_SCHEMA, SCHEMA_VERSION, read_columns
+from write_buffer import StatsWriteBuffer
+
+# Player tags are spread over this many hash buckets inside each date partition
+TAG_BUCKETS = 16
+
+# Hive layout: player_stats/date=YYYY-MM-DD/bucket=N/part-*.parquet
+PARTITION_SCHEMA = pa.schema([
+    ('date', pa.string()),
+    ('bucket', pa.int32()),
+])
+PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor='hive')
+DATASET_SCHEMA = pa.schema(list(STATS_SCHEMA) + list(PARTITION_SCHEMA))
+
+# Rows holding a full snapshot rather than an unchanged marker
+FULL_ROWS = ds.field('unchanged').is_null() | (ds.field('unchanged') == False)
+
+# Compaction may delete fragments between listing and reading them
+READ_ATTEMPTS = 3
+
+
+# Snapshots are mostly repeated values: zstd, dictionary pages only for the
+# dictionary-typed string columns, and statistics only where filters use them
+WRITE_OPTIONS = {
+    'compression': 'zstd',
+    'use_dictionary': [field.name for field in STATS_SCHEMA if pa.types.is_dictionary(field.type)],
+    'write_statistics': ['player_tag', 'timestamp'],
+}
+
+
+def tag_bucket(player_tag):
+    """Stable hash bucket for a player tag"""
+    return zlib.crc32(player_tag.encode('utf-8')) % TAG_BUCKETS
+
+
+def partition_path(timestamp, player_tag):
+    """Relative partition directory for a snapshot"""
+    return Path(f"date={timestamp:%Y-%m-%d}") / f"bucket={tag_bucket(player_tag)}"
+
+
+def sort_by_player(table):
+    """Sort rows by (player_tag, timestamp); Arrow can't sort dictionary columns, so use the decoded tags"""
+    keys = pa.table({'player_tag': table.column('player_tag').cast(pa.string()), 'timestamp': table.column('timestamp')})
+    order = pc.sort_indices(keys, sort_keys=[('player_tag', 'ascending'), ('timestamp', 'ascending')])
+    return table.take(order)
+
+
+def write_fragment(directory, table, prefix='part', **write_options):
+    """Write an immutable Parquet fragment, renaming it into place when complete"""
+    directory.mkdir(parents=True, exist_ok=True)
+    write_options = {**WRITE_OPTIONS, **write_options}
+    name = f"{prefix}-{datetime.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}.parquet"
+    # Dot-prefixed files are ignored by dataset discovery until renamed
+    tmp_path = directory / f".{name}.tmp"
+    pq.write_table(table, tmp_path, **write_options)
+    os.replace(tmp_path, directory / name)
+    return directory / name
+
+
+class ParquetStatsBackend(StatsBackend):
+    """Append-only fragments under data/player_stats, read through one dataset view
+
+    Writes add small immutable fragments (optionally batched behind a
+    write-ahead log); reads only open the player's hash bucket in the date
+    partitions they need and push filters down to the Parquet reader.
+    """
+
+    def __init__(self, data_dir='data', buffered=False, flush_rows=500, flush_interval=5.0):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(exist_ok=True)
+        self.dataset_dir = self.data_dir / 'player_stats'
+        self.dataset_dir.mkdir(exist_ok=True)
+        # Single-file store used before the dataset layout
+        self.stats_file = self.data_dir / 'player_stats.parquet'
+        self._migrate_legacy_file()
+        self._migrate_schema()
+
+        # Optionally log writes to a WAL and batch them into Parquet off the request path
+        self.buffer = None
+        if buffered:
+            self.buffer = StatsWriteBuffer(
+                self.data_dir / 'stats_wal',
+                self._write_rows,
+                max_rows=flush_rows,
+                max_age=flush_interval,
+            ).start()
+            self.buffer.replay()
+            atexit.register(self.buffer.close)
+
+    def _migrate_legacy_file(self):
+        """Move rows from the old single-file store into the partitioned dataset"""
+        if not self.stats_file.exists():
+            return
+
+        # Workers starting together must not each copy the file in
+        with file_lock(self.data_dir / '.migration.lock'):
+            if self.stats_file.exists():
+                self._migrate_locked()
+
+    def _migrate_locked(self):
+        df = pd.read_parquet(self.stats_file)
+        df = df.reindex(columns=STATS_SCHEMA.names)
+        table = pa.Table.from_pandas(df, schema=STATS_SCHEMA, preserve_index=False, safe=False)
+
+        if table.num_rows:
+            timestamps = df['timestamp']
+            table = table.append_column('date', pa.array(timestamps.dt.strftime('%Y-%m-%d'), pa.string()))
+            table = table.append_column('bucket', pa.array(df['player_tag'].astype(str).map(tag_bucket), pa.int32()))
+            ds.write_dataset(
+                table,
+                self.dataset_dir,
+                format='parquet',
+                partitioning=PARTITIONING,
+                basename_template=f"migrated-{uuid.uuid4().hex[:8]}-{{i}}.parquet",
+                existing_data_behavior='overwrite_or_ignore',
+            )
+
+        # Keep the original around instead of deleting it
+        os.replace(self.stats_file, self.stats_file.with_suffix('.parquet.migrated'))
+
+    def _schema_version(self):
+        """STATS_SCHEMA version the stored fragments were last rewritten to"""
+        try:
+            with open(self.dataset_dir / '_schema.json', 'r') as f:
+                return json.load(f)['version']
+        except FileNotFoundError:
+            # Fragments from before the version file used the original wide schema
+            return 1
+
+    def _migrate_schema(self):
+        """Rewrite fragments stored with an older STATS_SCHEMA"""
+        if self._schema_version() >= SCHEMA_VERSION:
+            return
+
+        # Compaction rewrites the same fragments, so share its lock
+        with file_lock(self.data_dir / '.compaction.lock'):
+            if self._schema_version() >= SCHEMA_VERSION:
+                return
+            migrated = 0
+            for path in self._fragment_paths(self._date_dirs()):
+                path = Path(path)
+                if pq.read_schema(path).equals(STATS_SCHEMA, check_metadata=False):
+                    continue
+                self._rewrite_fragment(path)
+                migrated += 1
+            atomic_write_json(self.dataset_dir / '_schema.json', {'version': SCHEMA_VERSION})
+            if migrated:
+                print(f"Migrated {migrated} stats fragments to schema version {SCHEMA_VERSION}")
+
+    def _rewrite_fragment(self, path):
+        """Rewrite one fragment in STATS_SCHEMA, keeping its row order and row groups"""
+        metadata = pq.ParquetFile(path).metadata
+        table = ds.dataset(str(path), format='parquet', schema=STATS_SCHEMA).to_table()
+        write_options = {}
+        if metadata.num_row_groups:
+            row_group = metadata.row_group(0)
+            write_options['row_group_size'] = max(row_group.num_rows, 1)
+            if row_group.sorting_columns:
+                write_options['sorting_columns'] = row_group.sorting_columns
+        # Same rename-then-remove order as compaction; readers drop the brief duplicates
+        write_fragment(path.parent, table, prefix=path.name.split('-', 1)[0], **write_options)
+        os.remove(path)
+
+    def _date_dirs(self, since=None, until=None):
+        """Date partition directories overlapping [since, until], oldest first"""
+        dirs = []
+        for date_dir in sorted(self.dataset_dir.glob('date=*')):
+            day = date_dir.name.split('=', 1)[1]
+            if since is not None and day < f"{since:%Y-%m-%d}":
+                continue
+            if until is not None and day > f"{until:%Y-%m-%d}":
+                continue
+            dirs.append(date_dir)
+        return dirs
+
+    def _fragment_paths(self, date_dirs, bucket=None, buckets=None):
+        """Fragment files under the given date partitions, optionally one bucket or a set of buckets only"""
+        if bucket is not None:
+            buckets = [bucket]
+        paths = []
+        for date_dir in date_dirs:
+            if buckets is not None:
+                bucket_dirs = [date_dir / f"bucket={bucket}" for bucket in sorted(buckets)]
+            else:
+                bucket_dirs = sorted(date_dir.glob('bucket=*'))
+            for bucket_dir in bucket_dirs:
+                paths.extend(str(path) for path in sorted(bucket_dir.glob('*.parquet')))
+        return paths
+
+    def _dataset(self, paths=None):
+        """Dataset view over every fragment, or only the given fragment files"""
+        if paths is None:
+            return ds.dataset(self.dataset_dir, format='parquet', partitioning=PARTITIONING, schema=DATASET_SCHEMA)
+        return ds.dataset(
+            paths,
+            format='parquet',
+            partitioning=PARTITIONING,
+            partition_base_dir=str(self.dataset_dir),
+            schema=DATASET_SCHEMA,
+        )
+
+    def _read_fragments(self, list_paths, columns, filter=None):
+        """Read fragments, re-listing them if compaction swapped files out mid-read"""
+        for attempt in range(READ_ATTEMPTS):
+            try:
+                return self._dataset(list_paths()).to_table(columns=columns, filter=filter)
+            except FileNotFoundError:
+                if attempt == READ_ATTEMPTS - 1:
+                    raise
+
+    def _player_filter(self, player_tag, since=None, until=None):
+        """Filter expression the Parquet reader can check against row group statistics"""
+        expr = ds.field('player_tag') == player_tag
+        if since is not None:
+            expr &= ds.field('timestamp') >= pa.scalar(pd.Timestamp(since).to_pydatetime(), pa.timestamp('us'))
+        if until is not None:
+            expr &= ds.field('timestamp') <= pa.scalar(pd.Timestamp(until).to_pydatetime(), pa.timestamp('us'))
+        return expr
+
+    def _buffered_rows(self):
+        """Snapshots logged by this or any other worker but not yet in Parquet"""
+        if not self.buffer:
+            return []
+        return self.buffer.rows() + self.buffer.peer_rows()
+
+    def _buffered_table(self, filter=None, columns=None, rows=None):
+        """Rows still waiting in write buffers, filtered like a dataset scan"""
+        if rows is None:
+            rows = self._buffered_rows()
+        if not rows:
+            return None
+        table = pa.Table.from_pylist(rows, schema=STATS_SCHEMA)
+        if filter is not None:
+            table = table.filter(filter)
+        return table.select(columns) if columns else table
+
+    def _read_player(self, player_tag, since=None, until=None, columns=None, date_dirs=None, include_buffered=True):
+        """Read one player's rows, only opening fragments in the player's hash bucket"""
+        if date_dirs is None:
+            date_dirs = self._date_dirs(since, until)
+        bucket = tag_bucket(player_tag)
+        columns = read_columns(columns)
+        filter = self._player_filter(player_tag, since, until)
+        # Snapshot the buffers before scanning so a concurrent flush can only
+        # produce duplicates, never gaps
+        buffered_rows = self._buffered_rows() if include_buffered else []
+        table = self._read_fragments(lambda: self._fragment_paths(date_dirs, bucket=bucket), columns, filter=filter)
+
+        buffered = self._buffered_table(filter, columns, rows=buffered_rows)
+        if buffered is not None and buffered.num_rows:
+            table = pa.concat_tables([table, buffered])
+        return table
+
+    def _write_rows(self, rows):
+        """Write a batch of snapshots as one fragment per partition"""
+        partitions = {}
+        for row in rows:
+            partitions.setdefault(partition_path(row['timestamp'], row['player_tag']), []).append(row)
+        for path, partition_rows in partitions.items():
+            write_fragment(self.dataset_dir / path, pa.Table.from_pylist(partition_rows, schema=STATS_SCHEMA))
+
+    def append(self, rows):
+        # Append small immutable fragments instead of rewriting history,
+        # or just log the rows when writes are buffered
+        if self.buffer:
+            for row in rows:
+                self.buffer.append(row)
+        else:
+            self._write_rows(rows)
+
+    def read_player(self, player_tag, since=None, until=None, columns=None, limit=None, oldest=False):
+        if not limit:
+            return self._read_player(player_tag, since=since, until=until, columns=columns)
+
+        # Walk date partitions newest (or oldest) first and stop once they
+        # hold `limit` rows; every row in the partitions left is further out
+        buffered_rows = self._buffered_rows()
+        tables, rows = [], 0
+        date_dirs = self._date_dirs(since, until)
+        for date_dir in (date_dirs if oldest else reversed(date_dirs)):
+            table = self._read_player(player_tag, since=since, until=until, columns=columns,
+                                      date_dirs=[date_dir], include_buffered=False)
+            tables.append(table)
+            rows += table.num_rows
+            if rows >= limit:
+                break
+
+        # Buffered rows are added whole: they may be newer than any of those
+        buffered = self._buffered_table(self._player_filter(player_tag, since, until), read_columns(columns),
+                                        rows=buffered_rows)
+        if buffered is not None and buffered.num_rows:
+            tables.append(buffered)
+        if not tables:
+            return STATS_SCHEMA.empty_table().select(read_columns(columns))
+        return pa.concat_tables(tables)
+
+    def read_latest(self, player_tag):
+        # Anything still buffered is newer than what has been flushed
+        buffered = self._buffered_table(ds.field('player_tag') == player_tag)
+        if buffered is not None and buffered.num_rows:
+            return buffered
+
+        # Walk date partitions newest first and stop at the first one with a hit
+        for date_dir in reversed(self._date_dirs()):
+            table = self._read_player(player_tag, date_dirs=[date_dir], include_buffered=False)
+            if table.num_rows:
+                return table
+        return STATS_SCHEMA.empty_table()
+
+    def read_base(self, player_tag, until, columns=None):
+        columns = read_columns(columns)
+        bucket = tag_bucket(player_tag)
+        filter = self._player_filter(player_tag, until=until) & FULL_ROWS
+        tables = []
+        # Buffered rows can be older than flushed ones from another worker,
+        # so keep them alongside the newest partition with a full row
+        buffered = self._buffered_table(filter, columns)
+        if buffered is not None and buffered.num_rows:
+            tables.append(buffered)
+
+        for date_dir in reversed(self._date_dirs(until=until)):
+            table = self._read_fragments(lambda: self._fragment_paths([date_dir], bucket=bucket), columns, filter=filter)
+            if table.num_rows:
+                tables.append(table)
+                break
+        return pa.concat_tables(tables) if tables else STATS_SCHEMA.empty_table().select(columns)
+
+    def read_range(self, since=None, until=None, columns=None, player_tags=None):
+        columns = read_columns(columns)
+        filter = None
+        if since is not None:
+            filter = ds.field('timestamp') >= pa.scalar(since, pa.timestamp('us'))
+        if until is not None:
+            before = ds.field('timestamp') < pa.scalar(until, pa.timestamp('us'))
+            filter = before if filter is None else filter & before
+        buckets = None
+        if player_tags is not None:
+            # Only the players' hash buckets need opening
+            buckets = {tag_bucket(player_tag) for player_tag in player_tags}
+            players = ds.field('player_tag').isin(list(player_tags))
+            filter = players if filter is None else filter & players
+        date_dirs = self._date_dirs(since, until)
+        buffered_rows = self._buffered_rows()
+        table = self._read_fragments(lambda: self._fragment_paths(date_dirs, buckets=buckets), columns, filter=filter)
+        buffered = self._buffered_table(filter, columns, rows=buffered_rows)
+        if buffered is not None and buffered.num_rows:
+            table = pa.concat_tables([table, buffered])
+        return table
+
+    def delete_before(self, cutoff):
+        # Whole date partitions only; readers re-list if one vanishes mid-read
+        for date_dir in self._date_dirs(until=cutoff - timedelta(days=1)):
+            shutil.rmtree(date_dir, ignore_errors=True)
+
+    def tracked_players(self):
+        buffered_rows = self._buffered_rows()
+        table = self._read_fragments(lambda: self._fragment_paths(self._date_dirs()), ['player_tag'])
+        buffered = self._buffered_table(columns=['player_tag'], rows=buffered_rows)
+        if buffered is not None:
+            table = pa.concat_tables([table, buffered])
+        return table.column('player_tag').unique().to_pylist()
+
+    def close(self):
+        if self.buffer:
+            self.buffer.close()
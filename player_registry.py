@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Registry of tracked players, kept up to date on every stats write"""
+
+import argparse
+import sqlite3
+import threading
+from datetime import timedelta
+from pathlib import Path
+from stats_backends import EPOCH
+
+# Columns the registry can be listed by
+SORT_COLUMNS = ('last_seen', 'first_seen', 'snapshot_count', 'player_tag')
+
+
+def _micros(timestamp):
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def _datetime(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class PlayerRegistry:
+    """One row per player tag: first/last seen, snapshot count and last name
+
+    Lives in its own small SQLite database (WAL mode) with indexes on the
+    sort columns, so listing players never touches historical stats.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS players ("
+                "player_tag TEXT PRIMARY KEY, "
+                "first_seen INTEGER NOT NULL, "
+                "last_seen INTEGER NOT NULL, "
+                "snapshot_count INTEGER NOT NULL, "
+                "last_name TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_players_last_seen ON players (last_seen)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_players_snapshot_count ON players (snapshot_count)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_players_first_seen ON players (first_seen)")
+            conn.execute("CREATE TABLE IF NOT EXISTS registry_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _connect(self):
+        """Per-thread connection; sqlite3 connections can't be shared between threads"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _upsert(conn, stats, count=1, first_seen=None):
+        last_seen = _micros(stats['timestamp'])
+        first_seen = last_seen if first_seen is None else _micros(first_seen)
+        # Expressions in DO UPDATE see the row's values from before the update
+        conn.execute(
+            "INSERT INTO players (player_tag, first_seen, last_seen, snapshot_count, last_name) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (player_tag) DO UPDATE SET "
+            "first_seen = MIN(first_seen, excluded.first_seen), "
+            "last_seen = MAX(last_seen, excluded.last_seen), "
+            "snapshot_count = snapshot_count + excluded.snapshot_count, "
+            "last_name = CASE WHEN excluded.last_seen >= last_seen THEN excluded.last_name ELSE last_name END",
+            (stats['player_tag'], first_seen, last_seen, count, stats.get('name')),
+        )
+
+    def record(self, stats):
+        """Count a saved snapshot against its player"""
+        with self._connect() as conn:
+            self._upsert(conn, stats)
+
+    def count(self):
+        """Number of registered players"""
+        return self._connect().execute("SELECT COUNT(*) FROM players").fetchone()[0]
+
+    def first_seen(self, player_tag=None):
+        """When a player, or any player when no tag is given, was first seen"""
+        if player_tag is None:
+            row = self._connect().execute("SELECT MIN(first_seen) FROM players").fetchone()
+        else:
+            row = self._connect().execute("SELECT first_seen FROM players WHERE player_tag = ?", (player_tag,)).fetchone()
+        return _datetime(row[0]) if row and row[0] is not None else None
+
+    def seen(self, player_tag):
+        """(first_seen, last_seen) for a player, or None if it isn't registered"""
+        row = self._connect().execute(
+            "SELECT first_seen, last_seen FROM players WHERE player_tag = ?", (player_tag,)
+        ).fetchone()
+        return (_datetime(row[0]), _datetime(row[1])) if row else None
+
+    def tags(self):
+        """Every registered player tag"""
+        return [row[0] for row in self._connect().execute("SELECT player_tag FROM players ORDER BY player_tag")]
+
+    def list_players(self, sort='last_seen', descending=True, offset=0, limit=100):
+        """One page of registry entries"""
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort column {sort!r}, expected one of {SORT_COLUMNS}")
+
+        direction = 'DESC' if descending else 'ASC'
+        rows = self._connect().execute(
+            "SELECT player_tag, first_seen, last_seen, snapshot_count, last_name FROM players "
+            f"ORDER BY {sort} {direction}, player_tag LIMIT ? OFFSET ?",
+            (limit, offset),
+        ).fetchall()
+        return [
+            {
+                'player_tag': player_tag,
+                'first_seen': _datetime(first_seen),
+                'last_seen': _datetime(last_seen),
+                'snapshot_count': snapshot_count,
+                'last_name': last_name,
+            }
+            for player_tag, first_seen, last_seen, snapshot_count, last_name in rows
+        ]
+
+    def _fill(self, conn, backend):
+        rebuilt = 0
+        for player_tag in backend.tracked_players():
+            table = backend.read_player(player_tag, columns=['name']).sort_by('timestamp')
+            if table.num_rows == 0:
+                continue
+            timestamps = table.column('timestamp').to_pylist()
+            # Unchanged marker rows don't store the name
+            names = table.column('name').drop_null()
+            name = names[-1].as_py() if len(names) else None
+            latest = {'player_tag': player_tag, 'timestamp': timestamps[-1], 'name': name}
+            self._upsert(conn, latest, count=table.num_rows, first_seen=timestamps[0])
+            rebuilt += 1
+        conn.execute("INSERT OR REPLACE INTO registry_meta (key, value) VALUES ('filled', '1')")
+        return rebuilt
+
+    def fill_once(self, backend):
+        """Fill a new registry from the stats already held by a storage backend
+
+        Runs in one write transaction, so processes starting together fill
+        it once and concurrent record() calls wait for the fill to commit.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM registry_meta WHERE key = 'filled'").fetchone():
+                return 0
+            return self._fill(conn, backend)
+
+    def rebuild(self, backend):
+        """Recreate every entry from the stats held by a storage backend"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM players")
+            return self._fill(conn, backend)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('command', choices=['rebuild', 'list'],
+                        help='rebuild: recreate the registry from stored history; list: print registered players')
+    parser.add_argument('--data-dir', default='data', help='Stats data directory')
+    parser.add_argument('--backend', default='parquet', help='Stats storage backend')
+    parser.add_argument('--sort', choices=SORT_COLUMNS, default='last_seen', help='Column to list players by')
+    parser.add_argument('--limit', type=int, default=50, help='Players to list')
+    args = parser.parse_args()
+
+    from data_store import PlayerStatsStore
+    store = PlayerStatsStore(args.data_dir, backend=args.backend)
+    if args.command == 'rebuild':
+        rebuilt = store.registry.rebuild(store.backend)
+        print(f"Rebuilt registry entries for {rebuilt} players")
+    else:
+        for entry in store.registry.list_players(sort=args.sort, limit=args.limit):
+            print(f"{entry['player_tag']:<14} {entry['last_name'] or '':<20} "
+                  f"{entry['snapshot_count']:>6} snapshots  last seen {entry['last_seen']:%Y-%m-%d %H:%M}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Token-bucket rate limiter shared by every process on a machine through SQLite"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class RateLimited(Exception):
+    """Raised when a token isn't available in time"""
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average and bursts of up to `burst`
+
+    The bucket lives in a small SQLite database (WAL mode), so Flask
+    workers, background jobs and CLIs on one machine draw from the same
+    quota. Each acquire refills and takes a token in one write transaction.
+    Counts of acquired and rejected calls and the time spent waiting are
+    kept alongside it; see stats().
+    """
+
+    def __init__(self, db_path, rate, burst=None, name='default'):
+        self.db_path = Path(db_path)
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.name = name
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT PRIMARY KEY, "
+                "tokens REAL NOT NULL, "
+                "updated REAL NOT NULL, "
+                "acquired INTEGER NOT NULL DEFAULT 0, "
+                "rejected INTEGER NOT NULL DEFAULT 0, "
+                "waited REAL NOT NULL DEFAULT 0, "
+                "max_wait REAL NOT NULL DEFAULT 0)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                (name, self.burst, time.time()),
+            )
+
+    def _connect(self):
+        """Per-thread connection; sqlite3 connections can't be shared between threads"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _take(self, conn, waited):
+        """Refill the bucket and take a token; returns 0, or the seconds until one is available"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, updated = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            now = time.time()
+            tokens = min(self.burst, tokens + max(now - updated, 0) * self.rate)
+            if tokens >= 1:
+                conn.execute(
+                    "UPDATE buckets SET tokens = ?, updated = ?, acquired = acquired + 1, "
+                    "waited = waited + ?, max_wait = MAX(max_wait, ?) WHERE name = ?",
+                    (tokens - 1, now, waited, waited, self.name),
+                )
+                wait = 0
+            else:
+                conn.execute("UPDATE buckets SET tokens = ?, updated = ? WHERE name = ?", (tokens, now, self.name))
+                wait = (1 - tokens) / self.rate
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def try_acquire(self, waited=0):
+        """Take a token if one is available; returns 0, or the seconds until one will be
+
+        waited is how long the caller has already waited, counted when the token is taken.
+        """
+        return self._take(self._connect(), waited)
+
+    def reject(self):
+        """Count a call turned away for lack of a token"""
+        self._connect().execute("UPDATE buckets SET rejected = rejected + 1 WHERE name = ?", (self.name,))
+
+    def acquire(self, timeout=None):
+        """Take a token, waiting up to timeout seconds for one (forever with None)
+
+        With timeout=0 the call fails fast. Returns the seconds spent
+        waiting; raises RateLimited when no token came in time.
+        """
+        started = time.monotonic()
+        while True:
+            waited = time.monotonic() - started
+            wait = self.try_acquire(waited)
+            if not wait:
+                return waited
+            if timeout is not None and waited + wait > timeout:
+                self.reject()
+                raise RateLimited(f"Rate limit of {self.rate:g}/s reached; next request allowed in {wait:.2f}s")
+            # Another process may take the token first; then this waits again
+            time.sleep(wait)
+
+    def stats(self):
+        """Acquired and rejected calls and wait times since the bucket was created"""
+        acquired, rejected, waited, max_wait = self._connect().execute(
+            "SELECT acquired, rejected, waited, max_wait FROM buckets WHERE name = ?", (self.name,)
+        ).fetchone()
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'acquired': acquired,
+            'rejected': rejected,
+            'total_wait': round(waited, 3),
+            'mean_wait': round(waited / acquired, 4) if acquired else 0.0,
+            'max_wait': round(max_wait, 3),
+        }
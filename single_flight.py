@@ -0,0 +1,87 @@
+"""Coalesce concurrent calls with the same key into one"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    """One in-flight call and the outcome its waiters share"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run one call per key at a time; callers arriving while it runs get its result
+
+    The first caller for a key runs the function; the rest block until it
+    finishes and then return the same result, or raise the same exception.
+    The next call after it finishes runs afresh. calls and shared count
+    the calls run and the callers that waited on another's call instead.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """fn(*args, **kwargs), or the result of the identical call already in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop
+
+    Waiters share one task; a waiter that is cancelled leaves the call
+    running for the others.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        """await fn(*args, **kwargs), or the result of the identical call already in flight"""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
@@ -0,0 +1,348 @@
+"""Storage backends behind PlayerStatsStore"""
+
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Repeated strings (tags, names, clan fields) are stored dictionary encoded
+DICT_STRING = pa.dictionary(pa.int32(), pa.string())
+
+# Explicit schema so every backend and every fragment agrees, even when a single
+# row has nulls. Counters use the narrowest int type their range fits in.
+STATS_SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('us')),
+    ('player_tag', DICT_STRING),
+    ('name', DICT_STRING),
+    ('exp_level', pa.int16()),
+    ('trophies', pa.int32()),
+    ('best_trophies', pa.int32()),
+    ('wins', pa.int32()),
+    ('losses', pa.int32()),
+    ('three_crown_wins', pa.int32()),
+    ('battle_count', pa.int32()),
+    ('clan_name', DICT_STRING),
+    ('clan_tag', DICT_STRING),
+    ('clan_role', DICT_STRING),
+    ('donations', pa.int32()),
+    ('donations_received', pa.int32()),
+    ('total_donations', pa.int32()),
+    ('challenge_cards_won', pa.int32()),
+    ('challenge_max_wins', pa.int16()),
+    ('tournament_cards_won', pa.int32()),
+    ('tournament_battle_count', pa.int32()),
+    ('war_day_wins', pa.int32()),
+    ('clan_cards_collected', pa.int32()),
+    ('total_cards', pa.int16()),
+    ('star_points', pa.int32()),
+    # Set on a snapshot identical to the player's previous one: only timestamp
+    # and player_tag are stored, the other values come from the last full row
+    ('unchanged', pa.bool_()),
+])
+
+# Bumped whenever STATS_SCHEMA changes; stored fragments are rewritten to match.
+# Adding a nullable column doesn't need a rewrite: older fragments read it as null.
+SCHEMA_VERSION = 2
+
+# Columns calculate_trends needs
+TREND_COLUMNS = ['timestamp', 'trophies', 'wins', 'losses', 'three_crown_wins']
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def read_columns(columns=None):
+    """Columns to read for a query
+
+    timestamp is always included for ordering, and unchanged so marker rows
+    can be filled in from the full row before them.
+    """
+    columns = list(columns) if columns else STATS_SCHEMA.names
+    for name in ('timestamp', 'unchanged'):
+        if name not in columns:
+            columns.append(name)
+    return columns
+
+
+def rows_to_table(rows, columns=None):
+    """Build a STATS_SCHEMA table from row dicts, keeping only the given columns"""
+    table = pa.Table.from_pylist(rows, schema=STATS_SCHEMA)
+    return table.select(columns) if columns else table
+
+
+def fill_unchanged(table):
+    """Fill unchanged marker rows in from the latest full row of the same player before them
+
+    Rows must be sorted by player and then timestamp. A marker with no full
+    row before it for its player is left as it is.
+    """
+    unchanged = table.column('unchanged').fill_null(False).to_numpy(zero_copy_only=False)
+    if not unchanged.any():
+        return table
+
+    positions = np.arange(table.num_rows)
+    source = np.maximum.accumulate(np.where(unchanged, -1, positions))
+    # Never take values from another player's row; a read without the
+    # player_tag column is a single player's
+    orphaned = source < 0
+    if 'player_tag' in table.column_names:
+        tags = table.column('player_tag').cast(pa.string())
+        orphaned |= pc.not_equal(tags.take(np.maximum(source, 0)), tags).to_numpy(zero_copy_only=False)
+    source = np.where(orphaned, positions, source)
+
+    for name in table.column_names:
+        if name not in ('timestamp', 'player_tag', 'unchanged'):
+            index = table.schema.get_field_index(name)
+            table = table.set_column(index, name, table.column(name).take(source))
+    return table
+
+
+class StatsBackend:
+    """Interface every stats storage backend implements
+
+    Rows are dicts shaped like STATS_SCHEMA. Reads return pyarrow Tables with
+    the requested columns (timestamp always included) in any order;
+    PlayerStatsStore sorts and converts them.
+    """
+
+    def append(self, rows):
+        """Store a batch of snapshot rows"""
+        raise NotImplementedError
+
+    def read_player(self, player_tag, since=None, until=None, columns=None, limit=None, oldest=False):
+        """One player's rows with since <= timestamp <= until
+
+        With a limit, the backend may stop after the newest `limit` rows, or
+        the oldest ones with oldest=True.
+        """
+        raise NotImplementedError
+
+    def read_latest(self, player_tag):
+        """A table holding at least the player's most recent row"""
+        return self.read_player(player_tag, limit=1)
+
+    def read_base(self, player_tag, until, columns=None):
+        """A table holding at least the player's newest full (not unchanged) row at or before until"""
+        table = self.read_player(player_tag, until=until, columns=columns)
+        return table.filter(pc.invert(pc.fill_null(table.column('unchanged'), False)))
+
+    def read_range(self, since=None, until=None, columns=None, player_tags=None):
+        """Every player's (or only the given players') rows with since <= timestamp < until"""
+        raise NotImplementedError
+
+    def delete_before(self, cutoff):
+        """Drop rows older than cutoff (a backend may keep a few more)"""
+        raise NotImplementedError
+
+    def tracked_players(self):
+        """Every player tag with stored stats"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release resources held by the backend"""
+
+
+class SQLiteStatsBackend(StatsBackend):
+    """Player stats in a SQLite database running in WAL mode
+
+    A (player_tag, timestamp DESC) index makes history, latest-stats and
+    tracked-player queries index lookups, and WAL mode lets readers in any
+    thread or process run while a writer commits. Timestamps are stored as
+    integer microseconds so they sort and compare like the Parquet column.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        column_defs = [
+            f"{field.name} {'TEXT' if pa.types.is_dictionary(field.type) else 'INTEGER'}"
+            + (' NOT NULL' if field.name in ('timestamp', 'player_tag') else '')
+            for field in STATS_SCHEMA
+        ]
+        with self._connect() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS player_stats ({', '.join(column_defs)})")
+            # Databases created before a column was added to STATS_SCHEMA
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(player_stats)")}
+            for name, column_def in zip(STATS_SCHEMA.names, column_defs):
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE player_stats ADD COLUMN {column_def}")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_player_stats_player_time "
+                "ON player_stats (player_tag, timestamp DESC)"
+            )
+
+    def _connect(self):
+        """Per-thread connection; sqlite3 connections can't be shared between threads"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _micros(timestamp):
+        return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+    def append(self, rows):
+        names = STATS_SCHEMA.names
+        values = [
+            tuple(self._micros(row['timestamp']) if name == 'timestamp' else row.get(name) for name in names)
+            for row in rows
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT INTO player_stats ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                values,
+            )
+
+    def read_player(self, player_tag, since=None, until=None, columns=None, limit=None, oldest=False):
+        return self._select(read_columns(columns), player_tag, since=since, until=until, limit=limit, oldest=oldest)
+
+    def read_base(self, player_tag, until, columns=None):
+        return self._select(read_columns(columns), player_tag, until=until, limit=1, full_only=True)
+
+    def read_range(self, since=None, until=None, columns=None, player_tags=None):
+        return self._select(read_columns(columns), since=since, before=until, player_tags=player_tags)
+
+    def delete_before(self, cutoff):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM player_stats WHERE timestamp < ?", (self._micros(cutoff),))
+
+    def _select(self, columns, player_tag=None, since=None, until=None, before=None, limit=None, full_only=False,
+                player_tags=None, oldest=False):
+        sql = f"SELECT {', '.join(columns)} FROM player_stats WHERE 1"
+        params = []
+        if player_tag is not None:
+            sql += " AND player_tag = ?"
+            params.append(player_tag)
+        if player_tags is not None:
+            sql += f" AND player_tag IN ({', '.join('?' * len(player_tags))})"
+            params.extend(player_tags)
+        if since is not None:
+            sql += " AND timestamp >= ?"
+            params.append(self._micros(since))
+        if until is not None:
+            sql += " AND timestamp <= ?"
+            params.append(self._micros(until))
+        if before is not None:
+            sql += " AND timestamp < ?"
+            params.append(self._micros(before))
+        if full_only:
+            sql += " AND NOT IFNULL(unchanged, 0)"
+        sql += " ORDER BY timestamp ASC" if oldest else " ORDER BY timestamp DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        rows = self._connect().execute(sql, params).fetchall()
+        values = list(zip(*rows)) if rows else [[] for _ in columns]
+        arrays = []
+        for name, column in zip(columns, values):
+            field_type = STATS_SCHEMA.field(name).type
+            if pa.types.is_dictionary(field_type):
+                arrays.append(pa.array(column, field_type))
+            else:
+                # Timestamps and flags come back as plain integers
+                arrays.append(pa.array(column, pa.int64()).cast(field_type))
+        return pa.Table.from_arrays(arrays, names=columns)
+
+    def tracked_players(self):
+        rows = self._connect().execute("SELECT DISTINCT player_tag FROM player_stats").fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class FirestoreStatsBackend(StatsBackend):
+    """Adapt functions/firestore_store.FirestorePlayerStatsStore to the backend interface
+
+    Firestore keeps UTC timestamps; they are converted to the naive local
+    time the other backends store. read_range and delete_before use a
+    collection group query on stats timestamps (see firestore.indexes.json).
+    """
+
+    def __init__(self, firestore_store):
+        self.store = firestore_store
+
+    def append(self, rows):
+        latest = {}
+        for row in rows:
+            player_tag = row['player_tag']
+            if row.get('unchanged'):
+                # Firestore readers treat every document as a full snapshot,
+                # so store the values the marker stands for
+                base = latest.get(player_tag) or self.store.get_latest_stats(player_tag)
+                if base is None:
+                    continue
+                row = {**base, 'timestamp': row['timestamp'], 'player_tag': player_tag}
+            row = {key: value for key, value in row.items() if key != 'unchanged'}
+            latest[player_tag] = row
+
+            # Same document layout as FirestorePlayerStatsStore.save_stats
+            timestamp = row['timestamp'].astimezone(timezone.utc)
+            stats_collection = self.store.players_collection.document(player_tag).collection('stats')
+            stats_collection.document(timestamp.strftime('%Y%m%d_%H%M%S')).set({**row, 'timestamp': timestamp})
+
+    def read_player(self, player_tag, since=None, until=None, columns=None, limit=None, oldest=False):
+        rows = []
+        # History comes back newest first, so the oldest rows need all of it
+        for stats in self.store.get_player_history(player_tag, limit=None if oldest else limit):
+            if not stats.get('timestamp'):
+                continue
+            timestamp = datetime.fromisoformat(stats['timestamp']).astimezone().replace(tzinfo=None)
+            if since is not None and timestamp < since:
+                continue
+            if until is not None and timestamp > until:
+                continue
+            rows.append({**stats, 'timestamp': timestamp})
+        return rows_to_table(rows, read_columns(columns))
+
+    def read_range(self, since=None, until=None, columns=None, player_tags=None):
+        if player_tags is not None:
+            queries = [self.store.players_collection.document(tag).collection('stats') for tag in player_tags]
+        else:
+            # Every player's stats subcollection at once
+            queries = [self.store.db.collection_group('stats')]
+        rows = []
+        for query in queries:
+            if since is not None:
+                query = query.where(filter=self._timestamp_filter('>=', since))
+            if until is not None:
+                query = query.where(filter=self._timestamp_filter('<', until))
+            for doc in query.stream():
+                stats = doc.to_dict()
+                if not stats.get('timestamp'):
+                    continue
+                timestamp = stats['timestamp'].astimezone().replace(tzinfo=None)
+                # The player is the parent document, whatever player_tag the stats hold
+                rows.append({**stats, 'timestamp': timestamp, 'player_tag': doc.reference.parent.parent.id})
+        return rows_to_table(rows, read_columns(columns))
+
+    def delete_before(self, cutoff):
+        query = self.store.db.collection_group('stats').where(filter=self._timestamp_filter('<', cutoff))
+        batch, pending = self.store.db.batch(), 0
+        for doc in query.stream():
+            batch.delete(doc.reference)
+            pending += 1
+            # A Firestore batch holds at most 500 writes
+            if pending == 500:
+                batch.commit()
+                batch, pending = self.store.db.batch(), 0
+        if pending:
+            batch.commit()
+
+    @staticmethod
+    def _timestamp_filter(op, timestamp):
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        return FieldFilter('timestamp', op, timestamp.astimezone(timezone.utc))
+
+    def tracked_players(self):
+        return self.store.get_all_tracked_players()
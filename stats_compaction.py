@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Compact small stats fragments into large files sorted by (player_tag, timestamp)"""
+
+import argparse
+import os
+import threading
+import time
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from data_store import PlayerStatsStore
+from parquet_backend import ParquetStatsBackend, sort_by_player, write_fragment
+from stats_backends import STATS_SCHEMA
+from file_lock import file_lock
+
+# Only rewrite a partition once it has this many files
+MIN_FRAGMENTS = 8
+
+# Rows per row group; small enough that each group's player_tag min/max spans few players
+ROW_GROUP_SIZE = 4096
+
+SORT_KEYS = [('player_tag', 'ascending'), ('timestamp', 'ascending')]
+
+
+def compact_partition(bucket_dir, row_group_size=ROW_GROUP_SIZE):
+    """Merge every fragment in one date/bucket partition into a single sorted file"""
+    paths = sorted(bucket_dir.glob('*.parquet'))
+    if len(paths) < 2:
+        return None
+
+    table = ds.dataset([str(path) for path in paths], format='parquet', schema=STATS_SCHEMA).to_table()
+    table = sort_by_player(table).combine_chunks()
+
+    # Rename the merged file into place before removing its inputs; readers
+    # may briefly see both and drop the duplicate timestamps.
+    compacted = write_fragment(
+        bucket_dir,
+        table,
+        prefix='compacted',
+        row_group_size=row_group_size,
+        sorting_columns=pq.SortingColumn.from_ordering(STATS_SCHEMA, SORT_KEYS),
+    )
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    return {
+        'partition': str(bucket_dir),
+        'fragments': len(paths),
+        'rows': table.num_rows,
+        'file': compacted.name,
+    }
+
+
+def compact_store(store, min_fragments=MIN_FRAGMENTS, row_group_size=ROW_GROUP_SIZE):
+    """Compact every partition of a PlayerStatsStore that has piled up small files
+
+    Only files present when a partition is listed are merged, so snapshots
+    written while compaction runs are left alone for the next pass.
+    """
+    results = []
+    # Other backends don't accumulate fragments
+    if not isinstance(store.backend, ParquetStatsBackend):
+        return results
+
+    # Only one compactor at a time, across every process sharing the data dir
+    with file_lock(store.data_dir / '.compaction.lock'):
+        for bucket_dir in sorted(store.backend.dataset_dir.glob('date=*/bucket=*')):
+            if len(list(bucket_dir.glob('*.parquet'))) < min_fragments:
+                continue
+            result = compact_partition(bucket_dir, row_group_size=row_group_size)
+            if result:
+                results.append(result)
+    return results
+
+
+class CompactionScheduler:
+    """Run compaction periodically on a background thread"""
+
+    def __init__(self, store, interval=3600, min_fragments=MIN_FRAGMENTS, row_group_size=ROW_GROUP_SIZE):
+        self.store = store
+        self.interval = interval
+        self.min_fragments = min_fragments
+        self.row_group_size = row_group_size
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stats-compaction', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ask the background thread to exit"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                compact_store(self.store, self.min_fragments, self.row_group_size)
+            except Exception as e:
+                print(f"Error compacting stats: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-dir', default='data', help='Stats data directory')
+    parser.add_argument('--min-fragments', type=int, default=MIN_FRAGMENTS,
+                        help='Only compact partitions with at least this many files')
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE,
+                        help='Rows per Parquet row group in compacted files')
+    parser.add_argument('--watch', type=int, metavar='SECONDS',
+                        help='Keep running, compacting every SECONDS')
+    args = parser.parse_args()
+
+    store = PlayerStatsStore(args.data_dir)
+    while True:
+        started = time.monotonic()
+        results = compact_store(store, args.min_fragments, args.row_group_size)
+        rows = sum(result['rows'] for result in results)
+        fragments = sum(result['fragments'] for result in results)
+        print(f"Compacted {fragments} files into {len(results)} ({rows} rows) in {time.monotonic() - started:.2f}s")
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == '__main__':
+    main()
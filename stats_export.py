@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Export stats history as Arrow IPC, Parquet or CSV, streamed a day at a time"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from parquet_backend import sort_by_player
+from stats_backends import STATS_SCHEMA
+from stats_retention import ROLLUP_SCHEMA, MarkerFiller, day_chunks, roll_up, rollup_columns, to_rollup, unique_rows
+
+# Export formats, their file extensions and HTTP content types
+EXPORT_FORMATS = {
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'csv': ('csv', 'text/csv'),
+}
+
+# Snapshots as exported: unchanged markers are filled in
+EXPORT_SCHEMA = pa.schema([field for field in STATS_SCHEMA if field.name != 'unchanged'])
+
+
+def export_schema(columns=None, resolution='raw'):
+    """Schema of the exported rows for the given stats columns and resolution
+
+    Every row is keyed by timestamp and player_tag, whichever columns are asked for.
+    """
+    if columns:
+        columns = ['timestamp', 'player_tag'] + [name for name in columns if name not in ('timestamp', 'player_tag')]
+    if resolution == 'raw':
+        return pa.schema([EXPORT_SCHEMA.field(name) for name in columns or EXPORT_SCHEMA.names])
+    return pa.schema([ROLLUP_SCHEMA.field(name) for name in rollup_columns(columns)])
+
+
+class _DayReader:
+    """Reads one level of a store's history a day at a time, oldest first
+
+    Raw days come from the storage backend with markers filled in; rollup
+    days come from their tier up to its watermark and are rolled up from
+    the next finer level after it.
+    """
+
+    def __init__(self, store, player_tags=None):
+        self.store = store
+        self.player_tags = player_tags
+        self.filler = MarkerFiller(store.rollups.tiers['hourly'])
+        self.watermarks = {resolution: store.rollups.watermark(resolution) for resolution in ('hourly', 'daily')}
+
+    def read(self, resolution, since, before):
+        """Rows of one level with since <= timestamp < before, sorted by (player_tag, timestamp)"""
+        if resolution == 'raw':
+            raw = self.store.backend.read_range(since, before, player_tags=self.player_tags)
+            if raw.num_rows:
+                raw = self.filler.fill(raw, since)
+            return raw.drop_columns(['unchanged'])
+
+        tier = self.store.rollups.tiers[resolution]
+        watermark = self.watermarks[resolution]
+        tables = []
+        if watermark is not None and since < watermark:
+            stored = tier.read(since=since, before=min(before, watermark))
+            if self.player_tags is not None:
+                tags = stored.column('player_tag').cast(pa.string())
+                stored = stored.filter(pc.is_in(tags, pa.array(self.player_tags)))
+            tables.append(unique_rows(sort_by_player(stored)))
+            since = watermark
+        if since < before:
+            finer = self.read('raw' if resolution == 'hourly' else 'hourly', since, before)
+            if resolution == 'hourly':
+                finer = to_rollup(finer)
+            tables.append(roll_up(finer, tier.unit))
+        tables = [table for table in tables if table.num_rows]
+        return pa.concat_tables(tables) if tables else ROLLUP_SCHEMA.empty_table()
+
+
+def iter_export_tables(store, player_tags=None, since=None, until=None, columns=None, resolution='raw'):
+    """Yield a PlayerStatsStore's history as one table per day, oldest day first
+
+    Rows have since <= timestamp < until and are sorted by (player_tag,
+    timestamp) within each day; only one day is held in memory at a time.
+    """
+    schema = export_schema(columns, resolution)
+    if since is None:
+        if player_tags is None:
+            since = store.registry.first_seen()
+        else:
+            first_seen = [store.registry.first_seen(player_tag) for player_tag in player_tags]
+            since = min([timestamp for timestamp in first_seen if timestamp], default=None)
+    until = until or datetime.now()
+    if since is None:
+        return
+
+    reader = _DayReader(store, player_tags)
+    for day, next_day in day_chunks(since, until):
+        table = reader.read(resolution, day, next_day)
+        if table.num_rows:
+            yield table.select(schema.names).cast(schema)
+
+
+def _open_writer(sink, schema, format):
+    if format == 'arrow':
+        return pa.ipc.new_stream(sink, schema)
+    if format == 'parquet':
+        return pq.ParquetWriter(sink, schema, compression='zstd')
+    return pacsv.CSVWriter(sink, _csv_schema(schema))
+
+
+def _csv_schema(schema):
+    """CSV has no dictionary type; write the decoded strings"""
+    return pa.schema([
+        pa.field(field.name, field.type.value_type) if pa.types.is_dictionary(field.type) else field
+        for field in schema
+    ])
+
+
+def _check_format(format):
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {format!r}, expected one of {list(EXPORT_FORMATS)}")
+
+
+def _write_tables(writer, tables, schema, format):
+    """Write tables one at a time, yielding each one's row count once it is written"""
+    for table in tables:
+        writer.write_table(table.cast(_csv_schema(schema)) if format == 'csv' else table)
+        yield table.num_rows
+
+
+def write_export(tables, sink, schema, format='parquet'):
+    """Write exported tables to a path or binary file object; returns the number of rows"""
+    _check_format(format)
+    with _open_writer(sink, schema, format) as writer:
+        return sum(_write_tables(writer, tables, schema, format))
+
+
+class _ChunkSink:
+    """Write-only file object that collects what a writer writes so it can be streamed out"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_export(store, format='parquet', **filters):
+    """Yield an export as chunks of bytes, one day of history at a time
+
+    Takes the same filters as iter_export_tables; suited to a streamed
+    HTTP response.
+    """
+    _check_format(format)
+    schema = export_schema(filters.get('columns'), filters.get('resolution', 'raw'))
+    sink = _ChunkSink()
+    with _open_writer(pa.PythonFile(sink, mode='w'), schema, format) as writer:
+        for _ in _write_tables(writer, iter_export_tables(store, **filters), schema, format):
+            yield sink.take()
+    yield sink.take()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('output', help="Output file, or - for stdout")
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS),
+                        help='Output format (default: from the output file extension, else parquet)')
+    parser.add_argument('--data-dir', default='data', help='Stats data directory')
+    parser.add_argument('--backend', default='parquet', help='Stats storage backend')
+    parser.add_argument('--players', help='Comma-separated player tags to export (default: all)')
+    parser.add_argument('--since', type=datetime.fromisoformat, help='Export snapshots from this time on')
+    parser.add_argument('--until', type=datetime.fromisoformat, help='Export snapshots before this time')
+    parser.add_argument('--fields', help='Comma-separated stats columns to export (default: all)')
+    parser.add_argument('--resolution', choices=['raw', 'hourly', 'daily'], default='raw', help='History level to export')
+    args = parser.parse_args()
+
+    format = args.format
+    if format is None:
+        extension = args.output.rsplit('.', 1)[-1]
+        format = next((name for name, (ext, _) in EXPORT_FORMATS.items() if ext == extension or name == extension), 'parquet')
+    columns = args.fields.split(',') if args.fields else None
+
+    from data_store import PlayerStatsStore
+    store = PlayerStatsStore(args.data_dir, backend=args.backend)
+    started = time.monotonic()
+    tables = iter_export_tables(
+        store,
+        player_tags=args.players.split(',') if args.players else None,
+        since=args.since,
+        until=args.until,
+        columns=columns,
+        resolution=args.resolution,
+    )
+    sink = sys.stdout.buffer if args.output == '-' else args.output
+    rows = write_export(tables, sink, export_schema(columns, args.resolution), format)
+    print(f"Exported {rows} rows as {format} in {time.monotonic() - started:.2f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
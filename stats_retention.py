@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""Roll raw stats up into hourly and daily tiers and expire old snapshots"""
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from file_lock import file_lock, atomic_write_json
+from parquet_backend import READ_ATTEMPTS, WRITE_OPTIONS, tag_bucket, sort_by_player, write_fragment
+from stats_backends import STATS_SCHEMA, fill_unchanged
+
+# Raw snapshots are kept this many days, hourly rollups this many; daily rollups forever
+RAW_RETENTION_DAYS = 30
+HOURLY_RETENTION_DAYS = 365
+
+# Resolutions from finest to coarsest, and the longest span each is picked for automatically
+RESOLUTIONS = ('raw', 'hourly', 'daily')
+RESOLUTION_SPANS = {'raw': timedelta(days=2), 'hourly': timedelta(days=60)}
+
+# Integer stats are rolled up as the period's first and last value plus its min and max
+METRICS = [field.name for field in STATS_SCHEMA if pa.types.is_integer(field.type)]
+
+# Fields kept from the period's first snapshot as well, so a window of rollups
+# can start where its first period started
+FIRST_FIELDS = ['timestamp', *METRICS]
+
+# A rollup row holds the last snapshot of its period (timestamp included),
+# how many snapshots the period had, min/max per metric and the period's
+# first snapshot as *_first columns
+ROLLUP_SCHEMA = pa.schema(
+    [field for field in STATS_SCHEMA if field.name != 'unchanged']
+    + [pa.field('snapshots', pa.int32())]
+    + [pa.field(f"{name}_{stat}", STATS_SCHEMA.field(name).type) for name in METRICS for stat in ('min', 'max')]
+    + [pa.field(f"{name}_first", STATS_SCHEMA.field(name).type) for name in FIRST_FIELDS]
+)
+
+# Rollup tiers are partitioned coarsely so a long history is a handful of files
+PARTITION_FORMATS = {'month': '%Y-%m', 'year': '%Y'}
+
+# A rollup partition's fragments are merged into one once this many pile up
+MERGE_FRAGMENTS = 8
+
+
+def _last_rows(table):
+    """Each player's last row in a table sorted by (player_tag, timestamp)"""
+    if table.num_rows == 0:
+        return table
+    tags = table.column('player_tag').cast(pa.string())
+    ends = np.ones(table.num_rows, dtype=bool)
+    ends[:-1] = pc.not_equal(tags.slice(0, table.num_rows - 1), tags.slice(1)).to_numpy(zero_copy_only=False)
+    return table.take(np.flatnonzero(ends))
+
+
+def unique_rows(table):
+    """Drop repeated (player_tag, timestamp) rows from a table sorted by both"""
+    if table.num_rows < 2:
+        return table
+    tags = table.column('player_tag').cast(pa.string())
+    timestamps = table.column('timestamp')
+    keep = np.ones(table.num_rows, dtype=bool)
+    keep[1:] = pc.or_(
+        pc.not_equal(tags.slice(1), tags.slice(0, table.num_rows - 1)),
+        pc.not_equal(timestamps.slice(1), timestamps.slice(0, table.num_rows - 1)),
+    ).to_numpy(zero_copy_only=False)
+    return table.filter(pa.array(keep))
+
+
+def rollup_columns(columns=None):
+    """Rollup columns to read for a query on the given stats columns"""
+    if not columns:
+        return ROLLUP_SCHEMA.names
+    names = [name for name in columns if name != 'unchanged']
+    if 'timestamp' not in names:
+        names.append('timestamp')
+    names.append('snapshots')
+    names += [f"{name}_{stat}" for name in columns if name in METRICS for stat in ('min', 'max')]
+    names += [f"{name}_first" for name in names[:] if name in FIRST_FIELDS]
+    return names
+
+
+def period_starts(table):
+    """Rollup rows with each stat replaced by its *_first value: the first snapshot of every period
+
+    Rows rolled up before rollups kept first snapshots fall back to the last one.
+    """
+    for name in FIRST_FIELDS:
+        first = f"{name}_first"
+        if name in table.column_names and first in table.column_names:
+            index = table.schema.get_field_index(name)
+            table = table.set_column(index, name, pc.coalesce(table.column(first), table.column(name)))
+    return table
+
+
+def to_rollup(table):
+    """Rollup-shaped rows for filled-in raw snapshots: one snapshot each, first = min = max = value"""
+    if 'unchanged' in table.column_names:
+        table = table.drop_columns(['unchanged'])
+    table = table.append_column('snapshots', pa.array(np.ones(table.num_rows, np.int32)))
+    for name in [name for name in table.column_names if name in METRICS]:
+        table = table.append_column(f"{name}_min", table.column(name))
+        table = table.append_column(f"{name}_max", table.column(name))
+    for name in [name for name in table.column_names if name in FIRST_FIELDS]:
+        table = table.append_column(f"{name}_first", table.column(name))
+    return table
+
+
+def roll_up(table, unit):
+    """Aggregate rollup-shaped rows sorted by (player_tag, timestamp) into one row per player and hour or day"""
+    if table.num_rows == 0:
+        return table
+
+    # A new group starts wherever the period or the player changes; a read
+    # without the player_tag column is a single player's
+    keys = [pc.floor_temporal(table.column('timestamp'), unit=unit)]
+    if 'player_tag' in table.column_names:
+        keys.append(table.column('player_tag').cast(pa.string()))
+    starts = np.zeros(table.num_rows, dtype=bool)
+    starts[0] = True
+    for key in keys:
+        starts[1:] |= pc.not_equal(key.slice(1), key.slice(0, table.num_rows - 1)).to_numpy(zero_copy_only=False)
+    groups = np.cumsum(starts) - 1
+    # Each group's last row carries the period's last snapshot, its first row the first
+    last_rows = np.flatnonzero(np.append(starts[1:], True))
+    first_rows = np.flatnonzero(starts)
+
+    aggregates = [('snapshots', 'sum')]
+    for name in table.column_names:
+        if name.endswith('_min'):
+            aggregates.append((name, 'min'))
+        elif name.endswith('_max'):
+            aggregates.append((name, 'max'))
+    grouped = (
+        table.select([name for name, _ in aggregates])
+        .append_column('group', pa.array(groups))
+        .group_by('group', use_threads=False)
+        .aggregate(aggregates)
+        .sort_by('group')
+    )
+
+    rolled = table.take(last_rows)
+    for name, aggregate in aggregates:
+        index = rolled.schema.get_field_index(name)
+        column = grouped.column(f"{name}_{aggregate}").cast(rolled.schema.field(name).type)
+        rolled = rolled.set_column(index, name, column)
+    for name in FIRST_FIELDS:
+        first = f"{name}_first"
+        if first in table.column_names:
+            column = period_starts(table.select([name, first])).column(name).take(first_rows)
+            rolled = rolled.set_column(rolled.schema.get_field_index(first), first, column)
+    return rolled
+
+
+class RollupTier:
+    """Per-player rollups at one resolution, in a Parquet dataset partitioned by month or year
+
+    Each partition/bucket holds a single file sorted by (player_tag,
+    timestamp) that is rewritten whenever new periods are added.
+    """
+
+    def __init__(self, name, directory, unit, partition):
+        self.name = name
+        self.directory = Path(directory)
+        self.unit = unit
+        self.partition = partition
+
+    def _partition_key(self, timestamp):
+        return f"{timestamp:{PARTITION_FORMATS[self.partition]}}"
+
+    def _partition_dirs(self, since=None, until=None):
+        """Partition directories overlapping [since, until], oldest first"""
+        dirs = []
+        for partition_dir in sorted(self.directory.glob(f"{self.partition}=*")):
+            key = partition_dir.name.split('=', 1)[1]
+            if since is not None and key < self._partition_key(since):
+                continue
+            if until is not None and key > self._partition_key(until):
+                continue
+            dirs.append(partition_dir)
+        return dirs
+
+    def _paths(self, partition_dirs, bucket=None):
+        paths = []
+        for partition_dir in partition_dirs:
+            pattern = f"bucket={bucket}/*.parquet" if bucket is not None else 'bucket=*/*.parquet'
+            paths.extend(str(path) for path in sorted(partition_dir.glob(pattern)))
+        return paths
+
+    def read(self, player_tag=None, since=None, until=None, before=None, columns=None):
+        """Rollup rows with since <= timestamp <= until and timestamp < before"""
+        expr = ds.scalar(True)
+        if player_tag is not None:
+            expr &= ds.field('player_tag') == player_tag
+        if since is not None:
+            expr &= ds.field('timestamp') >= pa.scalar(since, pa.timestamp('us'))
+        if until is not None:
+            expr &= ds.field('timestamp') <= pa.scalar(until, pa.timestamp('us'))
+        if before is not None:
+            expr &= ds.field('timestamp') < pa.scalar(before, pa.timestamp('us'))
+        last = min(until, before) if until is not None and before is not None else until or before
+        partition_dirs = self._partition_dirs(since, last)
+        bucket = tag_bucket(player_tag) if player_tag is not None else None
+        columns = columns or ROLLUP_SCHEMA.names
+
+        # Retention may drop partitions between listing and reading them
+        for attempt in range(READ_ATTEMPTS):
+            try:
+                paths = self._paths(partition_dirs, bucket)
+                return ds.dataset(paths, format='parquet', schema=ROLLUP_SCHEMA).to_table(columns=columns, filter=expr)
+            except FileNotFoundError:
+                if attempt == READ_ATTEMPTS - 1:
+                    raise
+                partition_dirs = self._partition_dirs(since, last)
+
+    def latest_before(self, player_tags, before):
+        """Each player's newest rollup row before a time, searching partitions newest first"""
+        remaining = set(player_tags)
+        found = []
+        for partition_dir in reversed(self._partition_dirs(until=before)):
+            if not remaining:
+                break
+            expr = ds.field('player_tag').isin(sorted(remaining)) & (ds.field('timestamp') < pa.scalar(before, pa.timestamp('us')))
+            table = ds.dataset(self._paths([partition_dir]), format='parquet', schema=ROLLUP_SCHEMA).to_table(filter=expr)
+            if table.num_rows:
+                table = _last_rows(sort_by_player(table))
+                found.append(table)
+                remaining -= set(table.column('player_tag').cast(pa.string()).to_pylist())
+        return pa.concat_tables(found) if found else ROLLUP_SCHEMA.empty_table()
+
+    @staticmethod
+    def _chunk(path):
+        """Start of the roll-up chunk a fragment holds, from its rollup-YYYYMMDDHH-... name"""
+        return path.name.split('-')[1]
+
+    def write(self, table, chunk_start):
+        """Add rollup rows for the periods from chunk_start on
+
+        Fragments are named after the chunk they hold, so ones left at or
+        after chunk_start by an interrupted run are replaced.
+        """
+        if table.num_rows == 0:
+            return
+        chunk = f"{chunk_start:%Y%m%d%H}"
+        keys = pc.strftime(table.column('timestamp'), format=PARTITION_FORMATS[self.partition]).to_pylist()
+        tags = table.column('player_tag').cast(pa.string()).to_pylist()
+        partitions = {}
+        for index, (key, player_tag) in enumerate(zip(keys, tags)):
+            partitions.setdefault((key, tag_bucket(player_tag)), []).append(index)
+
+        for (key, bucket), rows in partitions.items():
+            bucket_dir = self.directory / f"{self.partition}={key}" / f"bucket={bucket}"
+            paths = sorted(bucket_dir.glob('*.parquet'))
+            for path in paths:
+                if self._chunk(path) >= chunk:
+                    os.remove(path)
+            paths = [path for path in paths if self._chunk(path) < chunk]
+            if len(paths) >= MERGE_FRAGMENTS:
+                self._merge(bucket_dir, paths)
+            self._write_fragment(bucket_dir, table.take(rows), chunk)
+
+    def _write_fragment(self, bucket_dir, table, chunk):
+        table = sort_by_player(table).combine_chunks().select(ROLLUP_SCHEMA.names).cast(ROLLUP_SCHEMA)
+        write_fragment(bucket_dir, table, prefix=f"rollup-{chunk}",
+                       use_dictionary=[name for name in WRITE_OPTIONS['use_dictionary'] if name in ROLLUP_SCHEMA.names])
+
+    def _merge(self, bucket_dir, paths):
+        """Merge committed fragments into one; same rename-then-remove order as compaction"""
+        table = ds.dataset([str(path) for path in paths], format='parquet', schema=ROLLUP_SCHEMA).to_table()
+        self._write_fragment(bucket_dir, unique_rows(sort_by_player(table)), max(self._chunk(path) for path in paths))
+        for path in paths:
+            os.remove(path)
+
+    def drop_before(self, cutoff):
+        """Remove whole partitions that end before cutoff"""
+        for partition_dir in self._partition_dirs():
+            if partition_dir.name.split('=', 1)[1] < self._partition_key(cutoff):
+                shutil.rmtree(partition_dir, ignore_errors=True)
+
+
+class StatsRollups:
+    """The hourly and daily rollup tiers of a stats data directory and how far each reaches
+
+    Watermarks mark where each tier's committed periods end; anything after
+    a watermark is rolled up on the fly from the next finer level. Horizons
+    mark the oldest time a level still holds after retention.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = Path(data_dir)
+        self.state_path = self.data_dir / 'stats_rollups.json'
+        self.tiers = {
+            'hourly': RollupTier('hourly', self.data_dir / 'player_stats_hourly', 'hour', 'month'),
+            'daily': RollupTier('daily', self.data_dir / 'player_stats_daily', 'day', 'year'),
+        }
+
+    def state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'watermarks': {}, 'horizons': {}}
+
+    def _set(self, section, resolution, timestamp):
+        state = self.state()
+        state.setdefault(section, {})[resolution] = timestamp.isoformat()
+        atomic_write_json(self.state_path, state, indent=2)
+
+    def watermark(self, resolution, state=None):
+        """End of the last period committed to a rollup tier, or None"""
+        value = (state or self.state())['watermarks'].get(resolution)
+        return datetime.fromisoformat(value) if value else None
+
+    def horizon(self, resolution, state=None):
+        """Oldest time a level still holds after retention, or None if it holds everything"""
+        value = (state or self.state())['horizons'].get(resolution)
+        return datetime.fromisoformat(value) if value else None
+
+    def pick_resolution(self, since, until=None):
+        """Coarsest resolution a read of [since, until] needs
+
+        Short spans read raw snapshots, longer ones hourly and then daily
+        rollups, and a level is skipped once retention has dropped since.
+        """
+        state = self.state()
+        span = (until or datetime.now()) - since
+        for resolution in ('raw', 'hourly'):
+            horizon = self.horizon(resolution, state)
+            if span <= RESOLUTION_SPANS[resolution] and (horizon is None or since >= horizon):
+                return resolution
+        return 'daily'
+
+
+def day_chunks(start, end):
+    """Midnight-aligned [day, next day) chunks covering [start, end)"""
+    day = start
+    while day < end:
+        next_day = min(day.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1), end)
+        yield day, next_day
+        day = next_day
+
+
+class MarkerFiller:
+    """Fill unchanged markers in raw chunks read oldest first
+
+    The last full row of every player seen so far is carried from chunk to
+    chunk; a player's first marker before that falls back to the hourly
+    tier, whose last row before the chunk holds the same values.
+    """
+
+    def __init__(self, tier, carry=None):
+        self.tier = tier
+        # Optionally seeded with full rows the caller already holds
+        self.carry = carry
+
+    def fill(self, raw, start):
+        raw = sort_by_player(raw)
+        unchanged = raw.column('unchanged').fill_null(False).to_numpy(zero_copy_only=False)
+        tags = raw.column('player_tag').cast(pa.string()).to_numpy(zero_copy_only=False)
+        first_rows = np.ones(len(tags), dtype=bool)
+        first_rows[1:] = tags[1:] != tags[:-1]
+        leading = set(tags[first_rows & unchanged])
+
+        bases = []
+        if leading and self.carry is not None:
+            carried = self.carry.filter(pc.is_in(self.carry.column('player_tag').cast(pa.string()), pa.array(sorted(leading))))
+            bases.append(carried)
+            leading -= set(carried.column('player_tag').cast(pa.string()).to_pylist())
+        if leading:
+            base = self.tier.latest_before(leading, start)
+            base = base.select([name for name in raw.column_names if name != 'unchanged'])
+            bases.append(base.append_column('unchanged', pa.array([False] * base.num_rows)).select(raw.column_names))
+        if bases:
+            raw = sort_by_player(pa.concat_tables([base.cast(raw.schema) for base in bases] + [raw]))
+
+        filled = fill_unchanged(raw).filter(ds.field('timestamp') >= pa.scalar(start, pa.timestamp('us')))
+        # Carried rows hold full values now, even where they started as markers
+        last = _last_rows(filled)
+        last = last.set_column(last.schema.get_field_index('unchanged'), 'unchanged', pa.array([False] * last.num_rows))
+        if self.carry is not None:
+            stale = pc.is_in(self.carry.column('player_tag').cast(pa.string()), last.column('player_tag').cast(pa.string()))
+            last = pa.concat_tables([self.carry.filter(pc.invert(stale)), last])
+        self.carry = last
+        return filled
+
+
+def _roll_into(rollups, tier, start, end, read_chunk):
+    """Roll [start, end) into a tier a day at a time, writing each partition once per run"""
+    pending, pending_start, written = [], start, 0
+    for day, next_day in day_chunks(start, end):
+        if pending and tier._partition_key(day) != tier._partition_key(pending_start):
+            written += _commit(rollups, tier, pending, pending_start, day)
+            pending, pending_start = [], day
+        table = read_chunk(day, next_day)
+        if table.num_rows:
+            pending.append(roll_up(table, tier.unit))
+    return written + _commit(rollups, tier, pending, pending_start, end)
+
+
+def _commit(rollups, tier, pending, start, end):
+    """Write rolled-up rows, then move the tier's watermark past them"""
+    rows = pa.concat_tables(pending) if pending else None
+    if rows is not None:
+        tier.write(rows, start)
+    rollups._set('watermarks', tier.name, end)
+    return rows.num_rows if rows is not None else 0
+
+
+def roll_up_store(store, raw_days=RAW_RETENTION_DAYS, hourly_days=HOURLY_RETENTION_DAYS, now=None):
+    """Bring a PlayerStatsStore's rollup tiers up to date, then apply retention
+
+    Raw snapshots are only dropped once rolled up hourly, and hourly
+    rollups only once rolled up daily. An interrupted run resumes from the
+    last committed watermark.
+    """
+    now = now or datetime.now()
+    hourly_days = max(hourly_days, raw_days)
+    rollups = store.rollups
+    hourly, daily = rollups.tiers['hourly'], rollups.tiers['daily']
+    result = {'hourly_rows': 0, 'daily_rows': 0}
+
+    # Shares the compaction lock: both rewrite and remove fragments
+    with file_lock(store.data_dir / '.compaction.lock'):
+        start = rollups.watermark('hourly') or store.registry.first_seen()
+        if start is not None:
+            filler = MarkerFiller(hourly)
+
+            def read_raw(day, next_day):
+                raw = store.backend.read_range(since=day, until=next_day)
+                return to_rollup(filler.fill(raw, day)) if raw.num_rows else raw
+
+            start = start.replace(minute=0, second=0, microsecond=0)
+            end = now.replace(minute=0, second=0, microsecond=0)
+            result['hourly_rows'] = _roll_into(rollups, hourly, start, end, read_raw)
+
+        hourly_end = rollups.watermark('hourly')
+        start = rollups.watermark('daily') or store.registry.first_seen()
+        if start is not None and hourly_end is not None:
+            def read_hourly(day, next_day):
+                return unique_rows(sort_by_player(hourly.read(since=day, before=next_day)))
+
+            start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+            end = hourly_end.replace(hour=0, minute=0, second=0, microsecond=0)
+            result['daily_rows'] = _roll_into(rollups, daily, start, end, read_hourly)
+
+        # Only drop what a coarser tier already covers
+        if hourly_end is not None:
+            cutoff = min(now - timedelta(days=raw_days), hourly_end)
+            store.backend.delete_before(cutoff)
+            rollups._set('horizons', 'raw', cutoff)
+        daily_end = rollups.watermark('daily')
+        if daily_end is not None:
+            cutoff = min(now - timedelta(days=hourly_days), daily_end)
+            hourly.drop_before(cutoff)
+            rollups._set('horizons', 'hourly', cutoff)
+
+    return result
+
+
+class RollupScheduler:
+    """Roll up and expire stats periodically on a background thread"""
+
+    def __init__(self, store, interval=3600, raw_days=RAW_RETENTION_DAYS, hourly_days=HOURLY_RETENTION_DAYS):
+        self.store = store
+        self.interval = interval
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stats-rollup', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ask the background thread to exit"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                roll_up_store(self.store, self.raw_days, self.hourly_days)
+            except Exception as e:
+                print(f"Error rolling up stats: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-dir', default='data', help='Stats data directory')
+    parser.add_argument('--backend', default='parquet', help='Stats storage backend')
+    parser.add_argument('--raw-days', type=int, default=RAW_RETENTION_DAYS, help='Days of raw snapshots to keep')
+    parser.add_argument('--hourly-days', type=int, default=HOURLY_RETENTION_DAYS, help='Days of hourly rollups to keep')
+    args = parser.parse_args()
+
+    from data_store import PlayerStatsStore
+    store = PlayerStatsStore(args.data_dir, backend=args.backend)
+    started = time.monotonic()
+    result = roll_up_store(store, args.raw_days, args.hourly_days)
+    print(f"Rolled up {result['hourly_rows']} hourly and {result['daily_rows']} daily rows "
+          f"in {time.monotonic() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Hammer the stats store and kiss tracker from many processes and check nothing was lost"""
+
+import argparse
+import json
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PLAYER_TAGS = ['#STRESS0', '#STRESS1', '#STRESS2']
+
+
+def stats_worker(data_dir, backend, writes, buffered, player_data):
+    """Save snapshots for a few shared players, reading history as we go"""
+    from data_store import PlayerStatsStore
+    store = PlayerStatsStore(data_dir, backend=backend, buffered=buffered, flush_rows=25, flush_interval=0.5)
+    for n in range(writes):
+        player_tag = PLAYER_TAGS[n % len(PLAYER_TAGS)]
+        # Repeat values so some saves are stored as unchanged markers
+        store.save_stats(player_tag, {**player_data, 'trophies': n // 6})
+        if n % 10 == 0:
+            store.get_player_history(player_tag, limit=5)
+            store.calculate_trends(player_tag, days=7)
+    store.backend.close()
+
+
+def kiss_worker(kiss_file, writes):
+    """Kiss one card and kiss-then-slap another"""
+    import kiss_tracker
+    kiss_tracker.KISS_DATA_FILE = kiss_file
+    for n in range(writes):
+        kiss_tracker.add_kiss('Knight')
+        kiss_tracker.add_kiss('Archers')
+        kiss_tracker.remove_kiss('Archers')
+        kiss_tracker.get_leaderboard()
+
+
+def compaction_worker(data_dir, backend, stop):
+    """Compact continuously while the writers run"""
+    from data_store import PlayerStatsStore
+    from stats_compaction import compact_store
+    store = PlayerStatsStore(data_dir, backend=backend)
+    while not stop.is_set():
+        compact_store(store, min_fragments=2)
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--processes', type=int, default=8, help='Writer processes per store')
+    parser.add_argument('--writes', type=int, default=100, help='Writes per process')
+    parser.add_argument('--backend', choices=['parquet', 'sqlite'], default='parquet', help='Stats storage backend')
+    parser.add_argument('--unbuffered', action='store_true', help='Write stats without the WAL buffer')
+    args = parser.parse_args()
+
+    with open(Path(__file__).parent / 'sample_player_response.json', 'r') as f:
+        player_data = json.load(f)
+
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = str(Path(tmp) / 'data')
+        kiss_file = str(Path(tmp) / 'card_kisses.json')
+        # Create the store once so workers don't race on the initial layout
+        from data_store import PlayerStatsStore
+        PlayerStatsStore(data_dir, backend=args.backend)
+
+        stop = ctx.Event()
+        compactor = ctx.Process(target=compaction_worker, args=(data_dir, args.backend, stop))
+        workers = [ctx.Process(target=stats_worker, args=(data_dir, args.backend, args.writes, not args.unbuffered, player_data))
+                   for _ in range(args.processes)]
+        workers += [ctx.Process(target=kiss_worker, args=(kiss_file, args.writes))
+                    for _ in range(args.processes)]
+
+        started = time.monotonic()
+        compactor.start()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        stop.set()
+        compactor.join()
+        elapsed = time.monotonic() - started
+
+        import kiss_tracker
+        kiss_tracker.KISS_DATA_FILE = kiss_file
+        store = PlayerStatsStore(data_dir, backend=args.backend)
+        # Count stored rows directly; history reads drop duplicate timestamps
+        stored = sum(store.backend.read_player(player_tag, columns=['player_tag']).num_rows
+                     for player_tag in PLAYER_TAGS)
+        expected = args.processes * args.writes
+
+        failures = [f"worker {worker.name} exited with {worker.exitcode}"
+                    for worker in workers + [compactor] if worker.exitcode != 0]
+        if stored != expected:
+            failures.append(f"stats rows: expected {expected}, found {stored}")
+        for index, player_tag in enumerate(PLAYER_TAGS):
+            player_expected = args.processes * len(range(index, args.writes, len(PLAYER_TAGS)))
+            summary = store.summaries.get(player_tag) or {'checkpoints': []}
+            counted = sum(checkpoint['count'] for checkpoint in summary['checkpoints'])
+            if counted != player_expected:
+                failures.append(f"{player_tag} summary: expected {player_expected} snapshots, counted {counted}")
+        for player_tag in PLAYER_TAGS:
+            history = store.get_player_history(player_tag)
+            if history['trophies'].isna().any():
+                failures.append(f"{player_tag} history: unchanged snapshots not filled in")
+        registered = {entry['player_tag']: entry['snapshot_count'] for entry in store.list_tracked_players(limit=len(PLAYER_TAGS))}
+        for index, player_tag in enumerate(PLAYER_TAGS):
+            player_expected = args.processes * len(range(index, args.writes, len(PLAYER_TAGS)))
+            if registered.get(player_tag) != player_expected:
+                failures.append(f"{player_tag} registry: expected {player_expected} snapshots, counted {registered.get(player_tag)}")
+        if kiss_tracker.get_card_kisses('Knight') != expected:
+            failures.append(f"Knight kisses: expected {expected}, found {kiss_tracker.get_card_kisses('Knight')}")
+        if kiss_tracker.get_card_kisses('Archers') != 0:
+            failures.append(f"Archers kisses: expected 0, found {kiss_tracker.get_card_kisses('Archers')}")
+
+    print(f"{len(workers)} processes, {args.writes} writes each, in {elapsed:.1f}s")
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ No lost or corrupted updates")
+
+
+if __name__ == '__main__':
+    main()
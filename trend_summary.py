@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Per-player trend summaries kept up to date on every stats write"""
+
+import argparse
+import json
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import quote
+from file_lock import file_lock, atomic_write_json
+
+# Trend windows (days) answered from the summary without reading history
+SUMMARY_WINDOWS = (1, 7, 30)
+
+# Summary updates lock one of this many stripe files
+LOCK_STRIPES = 64
+
+# Snapshot fields trends are computed from
+TREND_FIELDS = ('trophies', 'wins', 'losses', 'three_crown_wins')
+
+
+def build_trends(latest, oldest, days, data_points):
+    """Trend dict from the newest and oldest snapshot in a window"""
+    trends = {
+        'trophy_change': int(latest['trophies'] - oldest['trophies']),
+        'win_change': int(latest['wins'] - oldest['wins']),
+        'loss_change': int(latest['losses'] - oldest['losses']),
+        'three_crown_change': int(latest['three_crown_wins'] - oldest['three_crown_wins']),
+        'days_tracked': days,
+        'data_points': data_points,
+        'win_rate': None
+    }
+
+    # Calculate win rate if we have battle data
+    total_battles = trends['win_change'] + trends['loss_change']
+    if total_battles > 0:
+        trends['win_rate'] = round((trends['win_change'] / total_battles) * 100, 1)
+
+    return trends
+
+
+def _json_value(value):
+    """Make a stats value JSON serializable"""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def same_snapshot(latest, stats):
+    """Whether stats repeats a summary's latest snapshot apart from the timestamp"""
+    if not latest:
+        return False
+    return all(latest.get(key) == _json_value(value) for key, value in stats.items() if key != 'timestamp')
+
+
+class TrendSummaryStore:
+    """One small JSON summary per player: the latest snapshot plus hourly checkpoints
+
+    Each checkpoint holds the first snapshot seen in an hour and how many
+    snapshots arrived in that hour, covering the longest summary window.
+    The oldest checkpoint inside a window is that window's boundary
+    snapshot, so trend lookups are bounded by the number of hours in the
+    window rather than by the length of the player's history.
+    """
+
+    def __init__(self, summary_dir):
+        self.summary_dir = Path(summary_dir)
+        self.summary_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, player_tag):
+        return self.summary_dir / f"{quote(player_tag, safe='')}.json"
+
+    def lock(self, player_tag):
+        """Cross-process lock for one player's read-modify-write"""
+        stripe = zlib.crc32(player_tag.encode('utf-8')) % LOCK_STRIPES
+        return file_lock(self.summary_dir / f".lock-{stripe}")
+
+    def get(self, player_tag):
+        """Load a player's summary, or None if there isn't one"""
+        path = self._path(player_tag)
+        if not path.exists():
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _write(self, player_tag, summary):
+        atomic_write_json(self._path(player_tag), summary)
+
+    def update(self, stats):
+        """Fold a freshly saved snapshot into its player's summary"""
+        with self.lock(stats['player_tag']):
+            return self.update_locked(stats, self.get(stats['player_tag']))
+
+    def update_locked(self, stats, summary):
+        """update() for a caller already holding lock() with the summary loaded"""
+        summary = summary or {'player_tag': stats['player_tag'], 'checkpoints': []}
+        self._apply(summary, stats)
+        self._write(stats['player_tag'], summary)
+        return summary
+
+    def _apply(self, summary, stats):
+        timestamp = stats['timestamp']
+        # Workers can commit snapshots slightly out of order
+        latest = summary.get('latest')
+        if not latest or latest['timestamp'] <= timestamp.isoformat():
+            summary['latest'] = {key: _json_value(value) for key, value in stats.items()}
+
+        hour = timestamp.replace(minute=0, second=0, microsecond=0).isoformat()
+        first = {field: _json_value(stats[field]) for field in TREND_FIELDS}
+        first['timestamp'] = timestamp.isoformat()
+        checkpoints = summary['checkpoints']
+
+        # Normally the snapshot lands in the last checkpoint, so search from the end
+        position = len(checkpoints)
+        while position and checkpoints[position - 1]['hour'] > hour:
+            position -= 1
+        if position and checkpoints[position - 1]['hour'] == hour:
+            checkpoint = checkpoints[position - 1]
+            checkpoint['count'] += 1
+            if first['timestamp'] < checkpoint['first']['timestamp']:
+                checkpoint['first'] = first
+        else:
+            checkpoints.insert(position, {'hour': hour, 'count': 1, 'first': first})
+
+        # Drop checkpoints that have aged out of the longest window
+        horizon = (timestamp - timedelta(days=max(SUMMARY_WINDOWS))).isoformat()
+        while checkpoints and checkpoints[0]['first']['timestamp'] < horizon:
+            checkpoints.pop(0)
+
+    def calculate_trends(self, summary, days, now=None):
+        """Trends for one window, resolved to the hour
+
+        The window starts at the first hourly checkpoint at or after the
+        cutoff, so it can be up to an hour shorter than the exact window.
+        """
+        cutoff = ((now or datetime.now()) - timedelta(days=days)).isoformat()
+        latest = summary.get('latest')
+        if not latest or latest['timestamp'] < cutoff:
+            return None
+
+        in_window = [checkpoint for checkpoint in summary['checkpoints'] if checkpoint['first']['timestamp'] >= cutoff]
+        data_points = sum(checkpoint['count'] for checkpoint in in_window)
+        if data_points < 2:
+            return None
+
+        return build_trends(latest, in_window[0]['first'], days, data_points)
+
+    def build(self, store, player_tag):
+        """A player's summary reconstructed from the raw history in a PlayerStatsStore, not yet written"""
+        since = datetime.now() - timedelta(days=max(SUMMARY_WINDOWS))
+        summary = {'player_tag': player_tag, 'checkpoints': []}
+        history = store.get_player_history(player_tag, since=since, resolution='raw')
+        if history.empty:
+            latest = store.get_latest_stats(player_tag)
+            rows = [latest] if latest else []
+        else:
+            rows = history.sort_values('timestamp').to_dict('records')
+
+        for row in rows:
+            row['timestamp'] = row['timestamp'].to_pydatetime()
+            self._apply(summary, row)
+        return summary
+
+    def rebuild(self, store):
+        """Reconstruct every summary from the raw history in a PlayerStatsStore"""
+        rebuilt = 0
+        for player_tag in store.get_all_tracked_players():
+            with self.lock(player_tag):
+                self._write(player_tag, self.build(store, player_tag))
+            rebuilt += 1
+        return rebuilt
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('command', choices=['rebuild'], help='rebuild: recompute all summaries from history')
+    parser.add_argument('--data-dir', default='data', help='Stats data directory')
+    args = parser.parse_args()
+
+    from data_store import PlayerStatsStore
+    store = PlayerStatsStore(args.data_dir)
+    rebuilt = store.summaries.rebuild(store)
+    print(f"Rebuilt trend summaries for {rebuilt} players")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Write-behind buffer for stats snapshots backed by a line-oriented write-ahead log"""
+
+import fcntl
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from file_lock import file_lock
+
+
+def _encode_row(row):
+    """One WAL line for a stats row"""
+    return json.dumps({key: value.isoformat() if isinstance(value, datetime) else value
+                       for key, value in row.items()})
+
+
+def _decode_row(line):
+    row = json.loads(line)
+    row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+    return row
+
+
+def _read_wal(path):
+    """Rows in a WAL file, skipping a torn last line from a concurrent append"""
+    rows = []
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    rows.append(_decode_row(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return rows
+
+
+class StatsWriteBuffer:
+    """Log snapshots to a WAL immediately and hand them to Parquet in batches
+
+    Appends are durable once they return (the WAL line is fsynced). Rows are
+    flushed by calling flush_rows(rows) on the background thread when
+    max_rows are buffered or the oldest buffered row is max_age seconds
+    old, so appends never wait for a batch to be written. While a batch is being
+    written it stays visible through rows() and its WAL is kept under a
+    separate name until the write succeeds, so a crash mid-flush replays it.
+
+    Every process logs to its own WAL in wal_dir and holds an flock on it
+    while running. WALs whose lock can be taken belong to dead processes and
+    are replayed; the rest belong to live workers and are read by
+    peer_rows() so their unflushed snapshots are visible everywhere.
+    """
+
+    def __init__(self, wal_dir, flush_rows, max_rows=500, max_age=5.0):
+        self.wal_dir = Path(wal_dir)
+        self.wal_dir.mkdir(parents=True, exist_ok=True)
+        self.name = f"wal-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.wal_path = self.wal_dir / f"{self.name}.jsonl"
+        self.flushing_path = self.wal_dir / f"{self.name}.jsonl.flushing"
+        self.flush_rows = flush_rows
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self._rows = []
+        self._flushing = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._wal = None
+        self._owner_fd = None
+        self._thread = None
+
+    def _wal_files(self, name):
+        return [self.wal_dir / f"{name}.jsonl.flushing", self.wal_dir / f"{name}.jsonl"]
+
+    def replay(self):
+        """Flush rows left in WALs by processes that are no longer running"""
+        replayed = 0
+        for lock_path in sorted(self.wal_dir.glob('wal-*.lock')):
+            name = lock_path.stem
+            if name == self.name:
+                continue
+            try:
+                with file_lock(lock_path, blocking=False):
+                    for path in self._wal_files(name):
+                        rows = _read_wal(path)
+                        if rows:
+                            self.flush_rows(rows)
+                            replayed += len(rows)
+                        if path.exists():
+                            os.remove(path)
+                    os.remove(lock_path)
+            except BlockingIOError:
+                # Owner is still alive
+                continue
+            except FileNotFoundError:
+                # Another process replayed it first
+                continue
+        return replayed
+
+    def start(self):
+        """Claim this process's WAL and start the time-based flush thread"""
+        lock_path = self.wal_dir / f"{self.name}.lock"
+        while True:
+            self._owner_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._owner_fd, fcntl.LOCK_EX)
+            # A replaying peer may have removed the file before we locked it
+            if lock_path.exists() and os.stat(lock_path).st_ino == os.fstat(self._owner_fd).st_ino:
+                break
+            os.close(self._owner_fd)
+        self._wal = open(self.wal_path, 'a')
+        self._thread = threading.Thread(target=self._run, name='stats-write-buffer', daemon=True)
+        self._thread.start()
+        return self
+
+    def append(self, row):
+        """Durably log a row and buffer it for the next batch"""
+        with self._lock:
+            self._wal.write(_encode_row(row) + '\n')
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._rows.append(row)
+            if self._oldest is None:
+                self._oldest = datetime.now()
+            full = len(self._rows) >= self.max_rows
+
+        if full:
+            # The flush thread writes the batch; the request doesn't wait for it
+            self._wake.set()
+
+    def rows(self):
+        """Rows this process logged but has not yet written to Parquet"""
+        with self._lock:
+            return self._flushing + self._rows
+
+    def peer_rows(self):
+        """Rows other live workers have logged but not yet written to Parquet"""
+        rows = []
+        for path in sorted(self.wal_dir.glob('wal-*.jsonl*')):
+            if path.name.split('.', 1)[0] != self.name:
+                rows.extend(_read_wal(path))
+        return rows
+
+    def flush(self):
+        """Write buffered rows out as one batch"""
+        with self._flush_lock:
+            with self._lock:
+                # A batch that failed last time is retried before rotating again
+                if not self._flushing:
+                    if not self._rows:
+                        return 0
+                    # Rotate the WAL so appends continue while the batch is written
+                    self._wal.close()
+                    os.replace(self.wal_path, self.flushing_path)
+                    self._wal = open(self.wal_path, 'a')
+                    self._flushing, self._rows = self._rows, []
+                    self._oldest = None
+
+            self.flush_rows(self._flushing)
+
+            with self._lock:
+                flushed = len(self._flushing)
+                self._flushing = []
+            os.remove(self.flushing_path)
+            return flushed
+
+    def close(self):
+        """Stop the flush thread, write out anything still buffered and release the WAL"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        if self._wal:
+            self.flush()
+            self._wal.close()
+            self._wal = None
+            os.remove(self.wal_path)
+        if self._owner_fd is not None:
+            os.remove(self.wal_dir / f"{self.name}.lock")
+            os.close(self._owner_fd)
+            self._owner_fd = None
+
+    def _run(self):
+        while True:
+            self._wake.wait(min(self.max_age, 1.0))
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            with self._lock:
+                full = len(self._rows) >= self.max_rows
+                oldest = self._oldest
+            if not full and (oldest is None or (datetime.now() - oldest).total_seconds() < self.max_age):
+                continue
+            try:
+                self.flush()
+                # Pick up WALs left behind by workers that died since startup
+                self.replay()
+            except Exception as e:
+                print(f"Error flushing stats buffer: {e}")